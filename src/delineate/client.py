@@ -1,81 +1,778 @@
+import asyncio
+import codecs
+import hashlib
 import json
 import logging
+import os
+import ssl
 import time
-from collections.abc import Iterator
+from collections.abc import AsyncIterator, Callable, Iterable, Iterator
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
 from dataclasses import dataclass, field
+from functools import cached_property
+from importlib.util import find_spec
 from pathlib import Path
-from typing import Any
+from typing import IO, Any, Self
 
 import httpx
 
 from .exceptions import LinearAPIError
+from .ratelimit import RateLimiter
 
 logger = logging.getLogger(__name__)
 
 GRAPHQL_URL = "https://api.linear.app/graphql"
 MAX_RETRIES = 3
+DEFAULT_PAGE_SIZE = 100
+MIN_PAGE_SIZE = 10
+#: The largest page Linear will return for a connection.
+MAX_PAGE_SIZE = 250
+#: The most complexity points Linear allows for a single query.
+MAX_COMPLEXITY = 10_000
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+#: Statuses meaning a partial download can't be resumed, so is thrown away.
+DOWNLOAD_GONE = (404, 410, 416)
+
+
+def _json_loads() -> Callable[[bytes], Any]:
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    loads: Callable[[bytes], Any] = orjson.loads
+    return loads
+
+
+#: Decodes a JSON document, using orjson when it is installed as it is much faster.
+_loads = _json_loads()
+_decoder = json.JSONDecoder()
+
+
+def _payload(query: str, variables: dict[str, Any] | None) -> dict[str, Any]:
+    payload: dict[str, Any] = {"query": query}
+    if variables:
+        payload["variables"] = variables
+    return payload
+
+
+def _result(
+    response: httpx.Response, limiter: RateLimiter, content: bytes | None = None
+) -> dict[str, Any] | None:
+    """
+    Return the ``data`` of a GraphQL response, or ``None`` if it was rate limited.
+    The ``content`` must be supplied if the response was streamed.
+    """
+    limiter.update(response.headers)
+    data: dict[str, Any] = _loads(response.content if content is None else content)
+    if "errors" in data:
+        errors: list[dict[str, Any]] = data["errors"]
+        if any(e.get("extensions", {}).get("code") == "RATELIMITED" for e in errors):
+            return None
+        raise LinearAPIError(errors)
+    response.raise_for_status()
+    result: dict[str, Any] = data["data"]
+    return result
+
+
+def _is_complexity_error(error: LinearAPIError) -> bool:
+    if isinstance(error.errors, str):
+        return False
+    return any("complex" in e.get("message", "").lower() for e in error.errors)
+
+
+def too_large(error: Exception) -> bool:
+    """
+    Whether ``error`` was caused by asking for too much in one request.
+    """
+    return isinstance(error, httpx.TimeoutException) or (
+        isinstance(error, LinearAPIError) and _is_complexity_error(error)
+    )
+
+
+@dataclass
+class PageSize:
+    """
+    A page size that adapts to the complexity and latency of each response,
+    growing while pages are cheap and fast and shrinking when they are not.
+    """
+
+    size: int = DEFAULT_PAGE_SIZE
+    #: Fraction of :data:`MAX_COMPLEXITY` a page should stay under.
+    complexity_target: float = 0.5
+    #: Response time, in seconds, a page should stay under.
+    seconds_target: float = 5.0
+
+    def observe(self, response: httpx.Response, seconds: float | None = None) -> None:
+        """
+        Adapt to a response, which took ``seconds`` to arrive, or its ``elapsed``
+        time if not supplied.
+        """
+        complexity_limit = MAX_COMPLEXITY * self.complexity_target
+        complexity = float(response.headers.get("x-complexity", 0))
+        if seconds is None:
+            seconds = response.elapsed.total_seconds()
+        if complexity > complexity_limit or seconds > self.seconds_target:
+            self.size = max(self.size // 2, MIN_PAGE_SIZE)
+            return
+        grown = min(self.size * 3 // 2, MAX_PAGE_SIZE)
+        # Complexity and response time scale roughly with the number of nodes:
+        scale = grown / self.size
+        if complexity * scale <= complexity_limit and seconds * scale <= self.seconds_target:
+            self.size = grown
+
+    def shrink(self, error: Exception) -> bool:
+        """
+        Shrink after an error caused by a page being too large, returning
+        ``True`` if the page should be retried at the new size.
+        """
+        if not too_large(error) or self.size <= MIN_PAGE_SIZE:
+            return False
+        self.size = max(self.size // 2, MIN_PAGE_SIZE)
+        logger.warning("%s, retrying with page size %d", error, self.size)
+        return True
+
+
+@dataclass
+class Transport:
+    """
+    How connections are made and reused. Requests to the API and downloads of
+    uploaded files each get their own pool of connections.
+    """
+
+    #: Multiplex requests over HTTP/2 connections, which needs the ``h2`` package.
+    http2: bool = False
+    #: Most connections open at once to the API.
+    api_connections: int = 10
+    #: Most connections open at once to download uploaded files.
+    upload_connections: int = 10
+    #: Seconds an idle connection is kept open for reuse.
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    #: Bytes of a downloaded file read and written at a time.
+    download_chunk_size: int = DOWNLOAD_CHUNK_SIZE
+
+    @cached_property
+    def _ssl_context(self) -> ssl.SSLContext:
+        # Shared by both pools, as creating one is slow:
+        return httpx.create_ssl_context()
+
+    def _options(self, connections: int) -> dict[str, Any]:
+        if self.http2 and find_spec("h2") is None:
+            raise RuntimeError("HTTP/2 requires the h2 package")
+        return {
+            "http2": self.http2,
+            "limits": httpx.Limits(
+                max_connections=connections,
+                max_keepalive_connections=connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            # Workers beyond the number of connections wait for one to be free,
+            # however long the requests using them take:
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=None),
+            "verify": self._ssl_context,
+        }
+
+    def client(self, headers: dict[str, str], uploads: bool = False) -> httpx.Client:
+        connections = self.upload_connections if uploads else self.api_connections
+        return httpx.Client(headers=headers, **self._options(connections))
+
+    def async_client(self, headers: dict[str, str], uploads: bool = False) -> httpx.AsyncClient:
+        connections = self.upload_connections if uploads else self.api_connections
+        return httpx.AsyncClient(headers=headers, **self._options(connections))
+
+
+def _preallocate(f: IO[bytes], offset: int, length: int) -> None:
+    """
+    Reserve space for the rest of a download, so the file system can keep it contiguous.
+    """
+    if length > 0 and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), offset, length)
+        except OSError:
+            # Such as when the file system does not support it:
+            pass
+
+
+@dataclass
+class Page:
+    """
+    A page of a connection. When streamed, its ``nodes`` are decoded as they
+    are iterated over and its ``page_info`` is only set once they all have been.
+    """
+
+    nodes: Iterable[dict[str, Any]]
+    page_info: dict[str, Any] = field(default_factory=dict)
+
+
+class _Body:
+    """
+    The body of a streamed response, read a chunk at a time, along with how
+    long has been spent waiting for it since the request was ``started``.
+    """
+
+    def __init__(self, response: httpx.Response, started: float) -> None:
+        self._chunks = response.iter_bytes()
+        self.seconds = time.monotonic() - started
+
+    def read(self) -> bytes | None:
+        started = time.monotonic()
+        chunk = next(self._chunks, None)
+        self.seconds += time.monotonic() - started
+        return chunk
+
+    def rest(self) -> bytes:
+        chunks = []
+        while (chunk := self.read()) is not None:
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class _AsyncBody:
+    """
+    An asyncio equivalent of :class:`_Body`.
+    """
+
+    def __init__(self, response: httpx.Response, started: float) -> None:
+        self._chunks = response.aiter_bytes()
+        self.seconds = time.monotonic() - started
+
+    async def read(self) -> bytes | None:
+        started = time.monotonic()
+        chunk = await anext(self._chunks, None)
+        self.seconds += time.monotonic() - started
+        return chunk
+
+    async def rest(self) -> bytes:
+        chunks = []
+        while (chunk := await self.read()) is not None:
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+class _NodeDecoder:
+    """
+    Decodes each node in the body of a response as soon as it has arrived,
+    where ``head`` is what has been read of the list of nodes so far.
+    """
+
+    #: Size of a partly arrived node above which decoding it is only tried
+    #: again once as much again has arrived.
+    retry_size = 64 * 1024
+
+    def __init__(self, head: bytes) -> None:
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = self._text.decode(head)
+        self._position = 0
+        # Text that has arrived since the buffer was last decoded from:
+        self._pending: list[str] = []
+        self._pending_size = 0
+        # How much undecoded text is needed before trying to decode a node again:
+        self._needed = 0
+        #: Whether the end of the list of nodes has been reached.
+        self.done = False
+
+    def nodes(self) -> Iterator[dict[str, Any]]:
+        """
+        Yield each node that has completely arrived.
+        """
+        undecoded = len(self._buffer) - self._position
+        if self._pending and undecoded + self._pending_size >= self._needed:
+            self._buffer = self._buffer[self._position :] + "".join(self._pending)
+            self._position = 0
+            self._pending.clear()
+            self._pending_size = 0
+        elif self._needed:
+            return
+        buffer = self._buffer
+        while True:
+            position = self._position
+            while position < len(buffer) and buffer[position] in ", \t\r\n":
+                position += 1
+            self._position = position
+            if position == len(buffer):
+                return
+            if buffer[position] == "]":
+                self.done = True
+                return
+            try:
+                node, self._position = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The node has not completely arrived yet. Decoding it starts
+                # again from its beginning, so for large nodes, wait for as much
+                # again to arrive to keep the time taken proportional to their size:
+                size = len(buffer) - position
+                self._needed = 2 * size if size > self.retry_size else 0
+                return
+            self._needed = 0
+            yield node
+
+    def feed(self, chunk: bytes | None) -> None:
+        """
+        Add the next ``chunk`` of the body, which is ``None`` if it has ended.
+        """
+        if chunk is None:
+            if self._pending:
+                # Decode what is left, whatever its size:
+                self._needed = 0
+                return
+            raise LinearAPIError(
+                f"Response ended within its nodes: {self._buffer[self._position :][:200]!r}"
+            )
+        text = self._text.decode(chunk)
+        self._pending.append(text)
+        self._pending_size += len(text)
+
+    def page_info(self, rest: bytes) -> dict[str, Any]:
+        """
+        Return the page info from what follows the nodes, given the ``rest`` of the body.
+        """
+        # The rest of the connection follows the nodes, then the end of the response:
+        text = (
+            self._buffer[self._position + 1 :]
+            + "".join(self._pending)
+            + self._text.decode(rest, final=True)
+        )
+        connection, end = _decoder.raw_decode("{" + text.lstrip().removeprefix(","))
+        tail = text[end:].lstrip()
+        if tail.startswith("}") and "".join(tail.split()) != "}}":
+            # Errors for a partial response follow its data:
+            try:
+                trailing, _ = _decoder.raw_decode("{" + tail[1:].lstrip().removeprefix(","))
+            except json.JSONDecodeError:
+                trailing = {}
+            if "errors" in trailing:
+                raise LinearAPIError(trailing["errors"])
+        if "".join(tail.split()) != "}}":
+            raise LinearAPIError(f"Unexpected end of response: {tail[:200]!r}")
+        page_info: dict[str, Any] = connection["pageInfo"]
+        return page_info
+
+
+def _stream_nodes(body: _Body, head: bytes, page: Page) -> Iterator[dict[str, Any]]:
+    """
+    Yield each node of a streamed response as it arrives, and then set the
+    ``page_info`` of the ``page`` from what follows them.
+    """
+    decoder = _NodeDecoder(head)
+    while True:
+        yield from decoder.nodes()
+        if decoder.done:
+            break
+        decoder.feed(body.read())
+    page.page_info = decoder.page_info(body.rest())
+
+
+async def _astream_nodes(
+    body: _AsyncBody, head: bytes, page: Page
+) -> AsyncIterator[dict[str, Any]]:
+    decoder = _NodeDecoder(head)
+    while True:
+        for node in decoder.nodes():
+            yield node
+        if decoder.done:
+            break
+        decoder.feed(await body.read())
+    page.page_info = decoder.page_info(await body.rest())
+
+
+async def _aiter(nodes: Iterable[dict[str, Any]]) -> AsyncIterator[dict[str, Any]]:
+    for node in nodes:
+        yield node
+
+
+class _Download:
+    """
+    A download of ``url`` to ``dest``, as described by :meth:`LinearClient.download`,
+    with what is needed to make its request and then write its response.
+    """
+
+    def __init__(self, url: str, dest: Path, resume: bool, chunk_size: int) -> None:
+        self.url = url
+        self.dest = dest
+        self.resume = resume
+        self.chunk_size = chunk_size
+        self.meta_path = dest.with_name(f"{dest.name}.meta")
+        self.offset = 0
+        #: Headers for the request, which ask for the rest of a partial download.
+        self.headers: dict[str, str] = {}
+        self._meta: dict[str, Any] | None = None
+        if resume and dest.exists() and self.meta_path.exists():
+            self._meta = json.loads(self.meta_path.read_text())
+            self.offset = dest.stat().st_size
+            self.headers = {"Range": f"bytes={self.offset}-", "If-Range": self._meta["etag"]}
+        #: Whether the content is encoded, so needs decoding as it is read.
+        self.encoded = False
+        self._length: int | None = None
+        self._hash = hashlib.sha256()
+        self._file: IO[bytes] | None = None
+
+    def start(self, response: httpx.Response) -> bool:
+        """
+        Get ready to write the content of the ``response``, returning ``False``
+        if the partial download has been discarded and it should start again.
+        """
+        content_range = response.headers.get("Content-Range", "")
+        total = content_range.rpartition("/")[2]
+        self._length = int(total) if total.isdigit() else None
+        resumed = response.status_code == 206 and self._meta is not None
+        # The rest of a file of a different length, or from the wrong place:
+        mismatched = (
+            resumed
+            and self._meta is not None
+            and not (
+                content_range.startswith(f"bytes {self.offset}-")
+                and self._length == self._meta["length"]
+            )
+        )
+        if response.status_code in DOWNLOAD_GONE or mismatched:
+            self.dest.unlink(missing_ok=True)
+            self.meta_path.unlink(missing_ok=True)
+            if self._meta is not None and (response.status_code == 416 or mismatched):
+                # The partial download is not a prefix of the file as it is now:
+                return False
+        response.raise_for_status()
+        self.encoded = "Content-Encoding" in response.headers
+        resumable = resumed
+        if resumed:
+            mode = "r+b"
+            with self.dest.open("rb") as f:
+                self._hash = hashlib.file_digest(f, "sha256")
+        else:
+            if response.status_code == 206:
+                raise LinearAPIError(f"Unexpected Content-Range for {self.url}: {content_range!r}")
+            content_length = response.headers.get("Content-Length")
+            self._length = int(content_length) if content_length else None
+            self.offset = 0
+            mode = "wb"
+            etag = response.headers.get("ETag")
+            # Ranges of encoded content can't be matched with what was decoded:
+            if self.resume and etag and not self.encoded:
+                self.meta_path.write_text(json.dumps({"etag": etag, "length": self._length}))
+                resumable = True
+            else:
+                self.meta_path.unlink(missing_ok=True)
+        self._file = self.dest.open(mode)
+        self._file.seek(self.offset)
+        # A download that can be resumed is continued from the size of its
+        # file, which preallocation would leave at the full length if the
+        # process were killed before the unwritten space was dropped:
+        if self._length is not None and not self.encoded and not resumable:
+            _preallocate(self._file, self.offset, self._length - self.offset)
+        return True
+
+    def write(self, chunk: bytes) -> None:
+        assert self._file is not None
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def close(self) -> None:
+        if self._file is not None:
+            # Drop any preallocated space that was not written:
+            self._file.truncate(self._file.tell())
+            self._file.close()
+
+    def finish(self) -> str:
+        """
+        Check the whole file has been written, returning the digest of its content.
+        """
+        size = self.dest.stat().st_size
+        if self._length is not None and not self.encoded and size != self._length:
+            raise LinearAPIError(
+                f"Download of {self.url} ended after {size} of {self._length} bytes"
+            )
+        self.meta_path.unlink(missing_ok=True)
+        return self._hash.hexdigest()
+
+
+def _back_off(limiter: RateLimiter, attempt: int) -> None:
+    wait = limiter.back_off(attempt)
+    logger.warning("Rate limited, retrying in %.1fs...", wait)
 
 
 @dataclass
 class LinearClient:
     api_key: str
+    max_retries: int = MAX_RETRIES
+    limiter: RateLimiter = field(default_factory=RateLimiter)
+    transport: Transport = field(default_factory=Transport)
     _http: httpx.Client = field(init=False, repr=False)
+    _uploads: httpx.Client = field(init=False, repr=False)
 
     def __post_init__(self) -> None:
-        self._http = httpx.Client(
-            headers={"Authorization": self.api_key},
-        )
+        headers = {"Authorization": self.api_key}
+        self._http = self.transport.client(headers)
+        self._uploads = self.transport.client(headers, uploads=True)
 
-    def query(self, query: str, variables: dict[str, Any] | None = None) -> dict[str, Any]:
-        payload: dict[str, Any] = {"query": query}
-        if variables:
-            payload["variables"] = variables
-
-        for attempt in range(MAX_RETRIES):
+    def _query(
+        self, query: str, variables: dict[str, Any] | None
+    ) -> tuple[dict[str, Any], httpx.Response]:
+        payload = _payload(query, variables)
+        for attempt in range(self.max_retries):
+            delay = self.limiter.acquire()
+            if delay > 0:
+                time.sleep(delay)
             response = self._http.post(GRAPHQL_URL, json=payload)
-            data: dict[str, Any] = response.json()
-
-            if "errors" in data:
-                errors: list[dict[str, Any]] = data["errors"]
-                if any(e.get("extensions", {}).get("code") == "RATELIMITED" for e in errors):
-                    wait = 2**attempt
-                    logger.warning("Rate limited, retrying in %ds...", wait)
-                    time.sleep(wait)
-                    continue
-                raise LinearAPIError(errors)
+            result = _result(response, self.limiter)
+            if result is not None:
+                return result, response
+            _back_off(self.limiter, attempt)
+        raise LinearAPIError("Rate limited after max retries")
 
-            response.raise_for_status()
-            result: dict[str, Any] = data["data"]
-            return result
+    def query(self, query: str, variables: dict[str, Any] | None = None) -> dict[str, Any]:
+        result, _ = self._query(query, variables)
+        return result
 
+    @contextmanager
+    def _stream(
+        self, query: str, connection_path: str, variables: dict[str, Any]
+    ) -> Iterator[tuple[Page, httpx.Response, _Body]]:
+        """
+        Query for a page of a connection. If the response starts with its nodes,
+        as Linear sends them, they are decoded as they arrive. Anything else,
+        such as errors, is decoded once it has all arrived.
+        """
+        payload = _payload(query, variables)
+        prefix = f'{{"data":{{"{connection_path}":{{"nodes":['.encode()
+        for attempt in range(self.max_retries):
+            delay = self.limiter.acquire()
+            if delay > 0:
+                time.sleep(delay)
+            started = time.monotonic()
+            with self._http.stream("POST", GRAPHQL_URL, json=payload) as response:
+                body = _Body(response, started)
+                head = b""
+                while len(head) < len(prefix) and (chunk := body.read()) is not None:
+                    head += chunk
+                if response.is_success and head.startswith(prefix):
+                    self.limiter.update(response.headers)
+                    page = Page(())
+                    page.nodes = _stream_nodes(body, head[len(prefix) :], page)
+                    yield page, response, body
+                    return
+                result = _result(response, self.limiter, head + body.rest())
+            if result is not None:
+                connection = result[connection_path]
+                yield Page(connection["nodes"], connection["pageInfo"]), response, body
+                return
+            _back_off(self.limiter, attempt)
         raise LinearAPIError("Rate limited after max retries")
 
+    def stream_pages(
+        self,
+        query: str,
+        connection_path: str,
+        variables: dict[str, Any] | None = None,
+        page_size: int | PageSize = DEFAULT_PAGE_SIZE,
+    ) -> Iterator[Page]:
+        """
+        Yield each page of a connection, starting after the ``after`` cursor if
+        one is in the ``variables``, with its nodes decoded as they arrive.
+        Each page must be finished with before the next is requested.
+        """
+        variables = dict(variables or {})
+        while True:
+            variables["first"] = page_size.size if isinstance(page_size, PageSize) else page_size
+            with ExitStack() as stack:
+                try:
+                    page, response, body = stack.enter_context(
+                        self._stream(query, connection_path, variables)
+                    )
+                except (LinearAPIError, httpx.TimeoutException) as e:
+                    if isinstance(page_size, PageSize) and page_size.shrink(e):
+                        continue
+                    raise
+                yield page
+                # Decode any nodes that were not used, to get to the page info:
+                for _ in page.nodes:
+                    pass
+            if isinstance(page_size, PageSize):
+                page_size.observe(response, body.seconds)
+            if not page.page_info["hasNextPage"]:
+                break
+            variables["after"] = page.page_info["endCursor"]
+
+    def pages(
+        self,
+        query: str,
+        connection_path: str,
+        variables: dict[str, Any] | None = None,
+        page_size: int | PageSize = DEFAULT_PAGE_SIZE,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yield each page of a connection, with its ``nodes`` and ``pageInfo``,
+        starting after the ``after`` cursor if one is in the ``variables``.
+        """
+        for page in self.stream_pages(query, connection_path, variables, page_size):
+            nodes = list(page.nodes)
+            yield {"nodes": nodes, "pageInfo": page.page_info}
+
     def paginate(
         self,
         query: str,
         connection_path: str,
         variables: dict[str, Any] | None = None,
-        page_size: int = 100,
+        page_size: int | PageSize = DEFAULT_PAGE_SIZE,
     ) -> Iterator[dict[str, Any]]:
+        for page in self.stream_pages(query, connection_path, variables, page_size):
+            yield from page.nodes
+
+    def download(self, url: str, dest: Path, resume: bool = False) -> str:
+        """
+        Download ``url`` to ``dest``, returning the SHA-256 digest of its content.
+
+        If ``resume``, the ETag and length of the download are recorded in
+        ``dest.meta`` so that, if it is interrupted, a later call can continue
+        from the end of ``dest`` with a range request. The server only sends
+        the rest if the file still has that ETag, and sends all of it otherwise.
+        What has been downloaded is kept when a request fails, unless the file
+        has gone or no longer matches it.
+        """
+        download = _Download(url, dest, resume, self.transport.download_chunk_size)
+        with self._uploads.stream("GET", url, headers=download.headers) as response:
+            if not download.start(response):
+                return self.download(url, dest, resume)
+            # Without an encoding to undo, the raw chunks can be written as they are:
+            read = response.iter_bytes if download.encoded else response.iter_raw
+            try:
+                for chunk in read(download.chunk_size):
+                    download.write(chunk)
+            finally:
+                download.close()
+        return download.finish()
+
+
+@dataclass
+class AsyncLinearClient:
+    """
+    An asyncio equivalent of :class:`LinearClient`, for running many requests
+    concurrently on one event loop.
+    """
+
+    api_key: str
+    max_retries: int = MAX_RETRIES
+    limiter: RateLimiter = field(default_factory=RateLimiter)
+    transport: Transport = field(default_factory=Transport)
+    _http: httpx.AsyncClient = field(init=False, repr=False)
+    _uploads: httpx.AsyncClient = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        headers = {"Authorization": self.api_key}
+        self._http = self.transport.async_client(headers)
+        self._uploads = self.transport.async_client(headers, uploads=True)
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+        await self._uploads.aclose()
+
+    async def query(self, query: str, variables: dict[str, Any] | None = None) -> dict[str, Any]:
+        payload = _payload(query, variables)
+        for attempt in range(self.max_retries):
+            delay = self.limiter.acquire()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            result = _result(await self._http.post(GRAPHQL_URL, json=payload), self.limiter)
+            if result is not None:
+                return result
+            _back_off(self.limiter, attempt)
+        raise LinearAPIError("Rate limited after max retries")
+
+    @asynccontextmanager
+    async def _stream(
+        self, query: str, connection_path: str, variables: dict[str, Any]
+    ) -> AsyncIterator[tuple[Page, AsyncIterator[dict[str, Any]], httpx.Response, _AsyncBody]]:
+        """
+        See :meth:`LinearClient._stream`. The nodes are yielded separately from
+        the page, which only gets its page info once they have all been.
+        """
+        payload = _payload(query, variables)
+        prefix = f'{{"data":{{"{connection_path}":{{"nodes":['.encode()
+        for attempt in range(self.max_retries):
+            delay = self.limiter.acquire()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            async with self._http.stream("POST", GRAPHQL_URL, json=payload) as response:
+                body = _AsyncBody(response, started)
+                head = b""
+                while len(head) < len(prefix) and (chunk := await body.read()) is not None:
+                    head += chunk
+                if response.is_success and head.startswith(prefix):
+                    self.limiter.update(response.headers)
+                    page = Page(())
+                    yield page, _astream_nodes(body, head[len(prefix) :], page), response, body
+                    return
+                result = _result(response, self.limiter, head + await body.rest())
+            if result is not None:
+                connection = result[connection_path]
+                page = Page(connection["nodes"], connection["pageInfo"])
+                yield page, _aiter(page.nodes), response, body
+                return
+            _back_off(self.limiter, attempt)
+        raise LinearAPIError("Rate limited after max retries")
+
+    async def paginate(
+        self,
+        query: str,
+        connection_path: str,
+        variables: dict[str, Any] | None = None,
+        page_size: int | PageSize = DEFAULT_PAGE_SIZE,
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        See :meth:`LinearClient.paginate`.
+        """
         variables = dict(variables or {})
-        variables["first"] = page_size
         while True:
-            result = self.query(query, variables)
-            connection = result[connection_path]
-            yield from connection["nodes"]
-            page_info = connection["pageInfo"]
-            if not page_info["hasNextPage"]:
+            variables["first"] = page_size.size if isinstance(page_size, PageSize) else page_size
+            async with AsyncExitStack() as stack:
+                try:
+                    page, nodes, response, body = await stack.enter_async_context(
+                        self._stream(query, connection_path, variables)
+                    )
+                except (LinearAPIError, httpx.TimeoutException) as e:
+                    if isinstance(page_size, PageSize) and page_size.shrink(e):
+                        continue
+                    raise
+                async for node in nodes:
+                    yield node
+            if isinstance(page_size, PageSize):
+                page_size.observe(response, body.seconds)
+            if not page.page_info["hasNextPage"]:
                 break
-            variables["after"] = page_info["endCursor"]
+            variables["after"] = page.page_info["endCursor"]
 
-    def download(self, url: str, dest: Path) -> None:
-        with self._http.stream("GET", url) as response:
-            response.raise_for_status()
-            with dest.open("wb") as f:
-                for chunk in response.iter_bytes():
-                    f.write(chunk)
+    async def download(self, url: str, dest: Path, resume: bool = False) -> str:
+        """
+        See :meth:`LinearClient.download`.
+        """
+        download = _Download(url, dest, resume, self.transport.download_chunk_size)
+        async with self._uploads.stream("GET", url, headers=download.headers) as response:
+            if not download.start(response):
+                return await self.download(url, dest, resume)
+            read = response.aiter_bytes if download.encoded else response.aiter_raw
+            try:
+                async for chunk in read(download.chunk_size):
+                    download.write(chunk)
+            finally:
+                download.close()
+        return download.finish()
 
 
-def client_from_auth(path: Path) -> LinearClient:
+def client_from_auth(
+    path: Path, max_retries: int = MAX_RETRIES, transport: dict[str, Any] | None = None
+) -> LinearClient:
+    """
+    Create a client from the authentication file at ``path``, with transport
+    settings from its ``transport`` section overridden by any in ``transport``.
+    """
     data = json.loads(path.read_text())
-    return LinearClient(api_key=data["api_key"])
+    settings = {**data.get("transport", {}), **(transport or {})}
+    return LinearClient(
+        api_key=data["api_key"], max_retries=max_retries, transport=Transport(**settings)
+    )
@@ -1,16 +1,27 @@
 import json
 import logging
+import os
+import queue
 import re
-import tempfile
+import shutil
+import sqlite3
+import threading
+from collections.abc import Callable, Iterable, Iterator
 from pathlib import Path
+from typing import Any, Self
 from urllib.parse import urlparse, urlunparse
 
 import httpx
 
 from .client import LinearClient
+from .exceptions import LinearAPIError
+from .export import write_atomic
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_QUEUE_SIZE = 1000
+MANIFEST_BATCH_SIZE = 100
+
 UPLOAD_URL_PATTERN = re.compile(r'!?\[([^\]]*)\]\((https://uploads\.linear\.app/[^)]+)\)')
 
 
@@ -25,6 +36,91 @@ def extract_upload_urls(text: str) -> list[tuple[str, str]]:
     return results
 
 
+class UrlIndex:
+    """
+    The upload URLs last found in the markdown of each entity, along with its
+    ``updatedAt``, stored in ``directory/entity_type.json``, so that only
+    entities that have changed need to be searched for new files.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict[str, dict[str, Any]]] = {}
+        self._dirty: set[str] = set()
+        #: The entities each URL returned by :meth:`new_urls` was found in.
+        self._sources: dict[str, list[tuple[str, str]]] = {}
+
+    def _for(self, entity_type: str) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            entries = self._entries.get(entity_type)
+            if entries is None:
+                path = self.directory / f"{entity_type}.json"
+                entries = json.loads(path.read_text()) if path.exists() else {}
+                self._entries[entity_type] = entries
+            return entries
+
+    def new_urls(
+        self, entity_type: str, entity: dict[str, Any], fields: Iterable[str]
+    ) -> list[tuple[str, str]]:
+        """
+        Return the display name and URL of each upload in the ``fields`` of an
+        entity that was not there when it was last seen, or none at all if it
+        has not been updated since.
+        """
+        # Fields left out of the export, such as by a profile, tell us nothing:
+        fields = [name for name in fields if name in entity]
+        if not fields:
+            return []
+        entries = self._for(entity_type)
+        previous = entries.get(entity["id"])
+        updated_at = entity.get("updatedAt")
+        if previous is not None and updated_at is not None and previous["updatedAt"] == updated_at:
+            return []
+        found: dict[str, str] = {}
+        for name in fields:
+            if text := entity[name]:
+                for display_name, url in extract_upload_urls(text):
+                    found.setdefault(url, display_name)
+        known = set(previous["urls"]) if previous is not None else set()
+        new = [(display_name, url) for url, display_name in found.items() if url not in known]
+        with self._lock:
+            entries[entity["id"]] = {"updatedAt": updated_at, "urls": sorted(found)}
+            self._dirty.add(entity_type)
+            for _, url in new:
+                self._sources.setdefault(url, []).append((entity_type, entity["id"]))
+        return new
+
+    def succeeded(self, url: str) -> None:
+        """
+        Forget which entities ``url`` was found in, as it has been downloaded.
+        """
+        with self._lock:
+            self._sources.pop(url, None)
+
+    def failed(self, url: str) -> None:
+        """
+        Forget that ``url`` was found, as it could not be downloaded, so that
+        the entities it was found in are searched for it again next time.
+        """
+        with self._lock:
+            for entity_type, uuid in self._sources.pop(url, []):
+                entry = self._entries[entity_type].get(uuid)
+                if entry is not None and url in entry["urls"]:
+                    entry["updatedAt"] = None
+                    entry["urls"].remove(url)
+                    self._dirty.add(entity_type)
+
+    def save(self, sync: bool = False) -> None:
+        with self._lock:
+            if self._dirty:
+                self.directory.mkdir(parents=True, exist_ok=True)
+            for entity_type in self._dirty:
+                data = json.dumps(self._entries[entity_type], separators=(",", ":"))
+                write_atomic(self.directory / f"{entity_type}.json", data.encode(), sync)
+            self._dirty.clear()
+
+
 def _file_uuid(url: str) -> str:
     parsed = urlparse(url)
     path_parts = parsed.path.rstrip("/").split("/")
@@ -37,51 +133,264 @@ def file_dir(base_dir: Path, url: str) -> Path:
     return base_dir / prefix / uuid
 
 
-def download_file(client: LinearClient, url: str, display_name: str, dest_dir: Path) -> str | None:
+def blob_path(base_dir: Path, digest: str) -> Path:
+    return base_dir / "blobs" / digest[:2] / digest
+
+
+def _link(blob: Path, dest: Path) -> None:
+    try:
+        os.link(blob, dest)
+    except OSError:
+        # Such as on file systems without hard links:
+        shutil.copyfile(blob, dest)
+
+
+def download_file(
+    client: LinearClient, url: str, display_name: str, dest_dir: Path, dedup: bool = False
+) -> str | None:
+    """
+    Download the file at ``url``, returning its filename or ``None`` if it
+    could not be downloaded. If ``dedup``, its content is stored once in
+    ``blobs/`` under its digest, and hard linked to from where it belongs.
+    """
     filename = display_name or "file"
     file_directory = file_dir(dest_dir, url)
     dest = file_directory / filename
     if dest.exists():
         return filename
-    # Download to temp file first, only create directory on success
+    # Download to a staging file first, only create directory on success.
+    # It is kept if the download is interrupted, so it can be resumed later.
+    partial_dir = dest_dir / ".partial"
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = partial_dir / _file_uuid(url)
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp_path = Path(tmp.name)
-        client.download(url, tmp_path)
+        content_digest = client.download(url, tmp_path, resume=True)
     except httpx.HTTPStatusError as e:
         logger.warning("Failed to download %s: %s", url, e.response.status_code)
-        tmp_path.unlink(missing_ok=True)
+        return None
+    except (httpx.TransportError, LinearAPIError) as e:
+        # Such as the connection dropping, leaving what was downloaded to be resumed:
+        logger.warning("Failed to download %s: %s", url, e)
         return None
     file_directory.mkdir(parents=True, exist_ok=True)
-    tmp_path.rename(dest)
+    if not dedup:
+        tmp_path.rename(dest)
+        return filename
+    blob = blob_path(dest_dir, content_digest)
+    if blob.exists():
+        tmp_path.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.rename(blob)
+    _link(blob, dest)
     return filename
 
 
-def load_manifest(dest_dir: Path) -> set[str]:
-    manifest_path = dest_dir / "manifest.jsonl"
-    urls: set[str] = set()
-    if manifest_path.exists():
-        for line in manifest_path.read_text().splitlines():
-            if line.strip():
-                entry = json.loads(line)
-                urls.add(entry["url"])
-    return urls
-
-
-def append_manifest(dest_dir: Path, url: str, filename: str) -> None:
-    manifest_path = dest_dir / "manifest.jsonl"
-    entry = json.dumps({"url": url, "filename": filename})
-    with manifest_path.open("a") as f:
-        f.write(entry + "\n")
-
-
-def download_all(client: LinearClient, urls: list[tuple[str, str]], dest_dir: Path) -> None:
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    already_downloaded = load_manifest(dest_dir)
-    for display_name, base_url in urls:
-        if base_url in already_downloaded:
-            continue
-        filename = download_file(client, base_url, display_name, dest_dir)
-        if filename is not None:
-            append_manifest(dest_dir, base_url, filename)
-            already_downloaded.add(base_url)
+class Manifest:
+    """
+    The files that have been downloaded, in ``manifest.sqlite``, mapping each
+    URL to its filename. Additions are committed in batches of ``batch_size``.
+    A ``manifest.jsonl`` written by earlier versions is imported when the
+    manifest is opened and then renamed to ``manifest.jsonl.migrated``.
+    """
+
+    def __init__(self, dest_dir: Path, batch_size: int = MANIFEST_BATCH_SIZE) -> None:
+        self.batch_size = batch_size
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(dest_dir / "manifest.sqlite", check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files (url TEXT PRIMARY KEY, filename TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._pending: dict[str, str] = {}
+        legacy = dest_dir / "manifest.jsonl"
+        if legacy.exists():
+            self._migrate(legacy)
+
+    def _migrate(self, path: Path) -> None:
+        with path.open() as f, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?)",
+                (
+                    (entry["url"], entry["filename"])
+                    for entry in (json.loads(line) for line in f if line.strip())
+                ),
+            )
+        # Importing again after an interruption here is harmless:
+        path.rename(path.with_name("manifest.jsonl.migrated"))
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def get(self, url: str) -> str | None:
+        """
+        Return the filename the file at ``url`` was downloaded as, if it has been.
+        """
+        with self._lock:
+            filename = self._pending.get(url)
+            if filename is None:
+                row = self._connection.execute(
+                    "SELECT filename FROM files WHERE url = ?", (url,)
+                ).fetchone()
+                if row is not None:
+                    filename = row[0]
+        return filename
+
+    def __contains__(self, url: object) -> bool:
+        return isinstance(url, str) and self.get(url) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            self._flush()
+            urls = [row[0] for row in self._connection.execute("SELECT url FROM files")]
+        return iter(urls)
+
+    def add(self, url: str, filename: str) -> None:
+        with self._lock:
+            self._pending[url] = filename
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?)", self._pending.items()
+            )
+        self._pending.clear()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
+
+
+class Downloader:
+    """
+    Downloads files on a pool of worker threads, fed through a bounded queue
+    so that URLs can be submitted while they are still being discovered.
+    See :func:`download_file` for ``dedup``.
+    """
+
+    def __init__(
+        self,
+        client: LinearClient,
+        dest_dir: Path,
+        workers: int = 1,
+        queue_size: int = DOWNLOAD_QUEUE_SIZE,
+        progress: Callable[[], None] | None = None,
+        dedup: bool = False,
+        failed: Callable[[str], None] | None = None,
+        succeeded: Callable[[str], None] | None = None,
+    ) -> None:
+        self.client = client
+        self.dest_dir = dest_dir
+        self.dedup = dedup
+        self.progress = progress
+        #: Called with each URL that could not be downloaded.
+        self.failed = failed
+        #: Called with each URL that has been downloaded, including by an earlier export.
+        self.succeeded = succeeded
+        self._queue: queue.Queue[tuple[str, str] | None] = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._manifest: Manifest | None = None
+        self._pending: dict[str, str] = {}
+        # Only files that could not be downloaded are remembered once done with,
+        # as the manifest has the rest:
+        self._failed: set[str] = set()
+        self._error: BaseException | None = None
+        self._aborted = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+
+    def __enter__(self) -> Self:
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: object) -> None:
+        if exc_type is not None:
+            # Don't wait for queued downloads when the producer has failed.
+            self._aborted = True
+            self._stop()
+        else:
+            self.close()
+
+    def submit(self, display_name: str, url: str) -> None:
+        with self._lock:
+            if self._manifest is None:
+                self._manifest = Manifest(self.dest_dir)
+            # Each URL is only queued once, so no two workers write the same file.
+            if url in self._pending:
+                return
+            failed = url in self._failed
+            queued = not failed and url not in self._manifest
+            if queued:
+                self._pending[url] = display_name
+        if queued:
+            # Blocks when the workers fall behind, applying back-pressure to the producer.
+            self._queue.put((display_name, url))
+        else:
+            # Already done with, so only report how that went:
+            done = self.failed if failed else self.succeeded
+            if done is not None:
+                done(url)
+
+    def pending(self) -> list[tuple[str, str]]:
+        """
+        The files submitted that have not yet been downloaded.
+        """
+        with self._lock:
+            return [(display_name, url) for url, display_name in self._pending.items()]
+
+    def _stop(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._manifest is not None:
+            self._manifest.close()
+
+    def close(self) -> None:
+        self._stop()
+        if self._error is not None:
+            raise self._error
+
+    def _work(self) -> None:
+        while (item := self._queue.get()) is not None:
+            if self._aborted or self._error is not None:
+                # Keep draining so producers are never blocked on a full queue.
+                continue
+            display_name, url = item
+            try:
+                filename = download_file(self.client, url, display_name, self.dest_dir, self.dedup)
+                if filename is not None:
+                    assert self._manifest is not None
+                    self._manifest.add(url, filename)
+                    if self.succeeded is not None:
+                        self.succeeded(url)
+                else:
+                    with self._lock:
+                        self._failed.add(url)
+                    if self.failed is not None:
+                        self.failed(url)
+                if self.progress is not None:
+                    self.progress()
+            except BaseException as e:  # noqa: BLE001
+                self._error = e
+            else:
+                with self._lock:
+                    del self._pending[url]
+
+
+def download_all(
+    client: LinearClient, urls: Iterable[tuple[str, str]], dest_dir: Path, workers: int = 1
+) -> None:
+    with Downloader(client, dest_dir, workers) as downloader:
+        for display_name, base_url in urls:
+            downloader.submit(display_name, base_url)
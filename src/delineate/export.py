@@ -1,142 +1,660 @@
+import hashlib
 import json
-from collections.abc import Iterator
-from dataclasses import dataclass
+import logging
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field, replace
+from datetime import UTC, datetime
+from itertools import chain
 from pathlib import Path
-from typing import Any
+from typing import Any, Self
 
-from .client import LinearClient
+import httpx
+
+from .client import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    LinearClient,
+    Page,
+    PageSize,
+    too_large,
+)
+from .exceptions import LinearAPIError
 from .queries import (
-    ATTACHMENTS,
-    COMMENTS,
-    CYCLES,
-    DOCUMENTS,
-    INITIATIVES,
-    ISSUE_LABELS,
-    ISSUES,
-    PROJECT_MILESTONES,
-    PROJECTS,
-    TEAMS,
-    USERS,
-    WORKFLOW_STATES,
+    FIELDS,
+    build_batch_query,
+    build_nested_query,
+    build_query,
+    ids_query,
+    nested_connections,
 )
 
+logger = logging.getLogger(__name__)
+
+#: No Linear workspace has data older than this.
+EPOCH = "2019-01-01T00:00:00.000Z"
+CHECKPOINT_INTERVAL = 60
+#: When written files are synced to disk: never, in batches or after every write.
+FSYNC_POLICIES = ("never", "batch", "always")
+#: How many files to write between syncs when syncing in batches.
+FSYNC_BATCH_SIZE = DEFAULT_PAGE_SIZE
+#: How many nodes to fetch the rest of a nested connection for in each request.
+NESTED_BATCH_SIZE = 20
+
+
+def _fsync(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_paths(paths: Iterable[Path]) -> None:
+    """
+    Make the content of each file durable, along with its entry in its directory.
+    """
+    directories = set()
+    for path in paths:
+        _fsync(path)
+        directories.add(path.parent)
+    for directory in directories:
+        _fsync(directory)
+
+
+def write_atomic(path: Path, data: bytes, sync: bool = False) -> None:
+    """
+    Write to a temporary file next to ``path`` and then rename it into place,
+    so that ``path`` never has partial content, syncing to disk if ``sync``.
+    """
+    # Unique to this thread, and created like any other file, so the umask applies:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    if sync:
+        _fsync(path.parent)
 
-def entity_path(base_dir: Path, entity_type: str, uuid: str) -> Path:
+
+def entity_path(
+    base_dir: Path, entity_type: str, uuid: str, created: set[Path] | None = None
+) -> Path:
+    """
+    Return the path of an entity's file, creating its directory unless it is
+    in ``created``, to which it is then added.
+    """
     prefix = uuid[:4]
     path = base_dir / entity_type / prefix / f"{uuid}.json"
-    path.parent.mkdir(parents=True, exist_ok=True)
+    if created is None or path.parent not in created:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if created is not None:
+            created.add(path.parent)
     return path
 
 
-def write_entity(base_dir: Path, entity_type: str, entity: dict[str, Any]) -> Path:
+def pretty_json(entity: dict[str, Any]) -> bytes:
+    """
+    Serialize an entity indented over several lines, as files have always been written.
+    """
+    return (json.dumps(entity, indent=2) + "\n").encode()
+
+
+def _compact_json() -> Callable[[dict[str, Any]], bytes]:
+    try:
+        import orjson
+    except ImportError:
+        return lambda entity: (
+            json.dumps(entity, separators=(",", ":"), ensure_ascii=False) + "\n"
+        ).encode()
+    return lambda entity: orjson.dumps(entity, option=orjson.OPT_APPEND_NEWLINE)
+
+
+#: Serializes an entity on one line, using orjson when it is installed as it is much faster.
+compact_json = _compact_json()
+
+
+def digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+class HashIndex:
+    """
+    A compact digest of the content last written for each entity, stored in
+    ``directory/entity_type.json``, so unchanged entities need not be rewritten.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._digests: dict[str, dict[str, str]] = {}
+        self._dirty: set[str] = set()
+
+    def _for(self, entity_type: str) -> dict[str, str]:
+        with self._lock:
+            digests = self._digests.get(entity_type)
+            if digests is None:
+                path = self.directory / f"{entity_type}.json"
+                digests = json.loads(path.read_text()) if path.exists() else {}
+                self._digests[entity_type] = digests
+            return digests
+
+    def get(self, entity_type: str, uuid: str) -> str | None:
+        return self._for(entity_type).get(uuid)
+
+    def set(self, entity_type: str, uuid: str, digest: str) -> None:
+        self._for(entity_type)[uuid] = digest
+        self._dirty.add(entity_type)
+
+    def discard(self, entity_type: str, uuid: str) -> None:
+        if self._for(entity_type).pop(uuid, None) is not None:
+            self._dirty.add(entity_type)
+
+    def save(self, sync: bool = False) -> None:
+        with self._lock:
+            if self._dirty:
+                self.directory.mkdir(parents=True, exist_ok=True)
+            for entity_type in self._dirty:
+                data = json.dumps(self._digests[entity_type], separators=(",", ":"))
+                write_atomic(self.directory / f"{entity_type}.json", data.encode(), sync)
+            self._dirty.clear()
+
+
+def write_entity(
+    base_dir: Path,
+    entity_type: str,
+    entity: dict[str, Any],
+    hashes: HashIndex | None = None,
+    serialize: Callable[[dict[str, Any]], bytes] = pretty_json,
+    created: set[Path] | None = None,
+    sync: bool = False,
+) -> Path | None:
+    """
+    Atomically write an entity to its file, returning the path, or ``None`` if
+    the ``hashes`` show the file already has this content.
+    """
     uuid: str = entity["id"]
-    path = entity_path(base_dir, entity_type, uuid)
-    path.write_text(json.dumps(entity, indent=2) + "\n")
+    path = entity_path(base_dir, entity_type, uuid, created)
+    data = serialize(entity)
+    if hashes is not None:
+        current = digest(data)
+        if hashes.get(entity_type, uuid) == current and path.exists():
+            return None
+    write_atomic(path, data, sync)
+    if hashes is not None:
+        hashes.set(entity_type, uuid, current)
     return path
 
 
-class LatestData(dict[str, str]):
+class JSONData[T](dict[str, T]):
     @classmethod
-    def load(cls, path: Path) -> "LatestData":
+    def load(cls, path: Path) -> Self:
         if path.exists():
             return cls(json.loads(path.read_text()))
         return cls()
 
-    def save(self, path: Path) -> None:
+    def save(self, path: Path, sync: bool = False) -> None:
         path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text(json.dumps(dict(self), indent=2) + "\n")
+        write_atomic(path, (json.dumps(dict(self), indent=2) + "\n").encode(), sync)
+
+
+class LatestData(JSONData[str]):
+    """
+    The most recent ``updatedAt`` seen for each entity type.
+    """
+
+
+class PageSizes(JSONData[int]):
+    """
+    The page size each entity type settled on, so the next export starts from it.
+    """
+
+
+def _timestamp(value: datetime) -> str:
+    return value.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def time_slices(start: str, count: int, end: datetime | None = None) -> list[dict[str, str]]:
+    """
+    Split the time from ``start`` until ``end`` into ``count`` equal ranges,
+    returned as filter comparators that between them cover all time.
+    """
+    lower = datetime.fromisoformat(start)
+    step = ((end or datetime.now(UTC)) - lower) / count
+    bounds = [_timestamp(lower + step * i) for i in range(1, count)]
+    comparators: list[dict[str, str]] = []
+    for i in range(count):
+        comparator = {}
+        if i > 0:
+            comparator["gt"] = bounds[i - 1]
+        if i < count - 1:
+            comparator["lte"] = bounds[i]
+        comparators.append(comparator)
+    return comparators
+
+
+def merged[T](iterators: list[Iterator[T]], buffer: int = DEFAULT_PAGE_SIZE) -> Iterator[T]:
+    """
+    Consume each iterator on its own thread, yielding items as they arrive.
+    """
+    results: queue.Queue[tuple[T] | BaseException | None] = queue.Queue(maxsize=buffer)
+    stopped = threading.Event()
+
+    def put(item: tuple[T] | BaseException | None) -> bool:
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def run(iterator: Iterator[T]) -> None:
+        try:
+            for item in iterator:
+                if not put((item,)):
+                    return
+        except BaseException as e:  # noqa: BLE001
+            put(e)
+        else:
+            put(None)
+
+    threads = [threading.Thread(target=run, args=(i,), daemon=True) for i in iterators]
+    for thread in threads:
+        thread.start()
+    try:
+        running = len(threads)
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                yield result[0]
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
 
 
 @dataclass
 class Export:
     entity_type: str
-    query: str
     connection_path: str
     markdown_fields: tuple[str, ...] = ()
+    #: The fields selected from each node, all of those in :data:`FIELDS` by default.
+    fields: tuple[str, ...] = ()
+    #: Whether the first page is small enough to fetch along with those of other exports.
+    batched: bool = False
+    query: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if not self.fields:
+            self.fields = FIELDS[self.connection_path]
+        self.query = build_query(self.connection_path, self.fields)
+
+    def _slices(
+        self, latest: LatestData | None, slices: int, slice_field: str
+    ) -> list[dict[str, Any]]:
+        filter_: dict[str, Any] = {}
+        since = latest.get(self.entity_type) if latest is not None else None
+        if since is not None:
+            filter_["updatedAt"] = {"gt": since}
+        if slices == 1:
+            return [filter_]
+        start = since if since is not None and slice_field == "updatedAt" else EPOCH
+        return [
+            {**filter_, slice_field: {**filter_.get(slice_field, {}), **comparator}}
+            for comparator in time_slices(start, slices)
+        ]
 
     def items(
-        self, client: LinearClient, latest: LatestData | None = None
+        self,
+        client: LinearClient,
+        latest: LatestData | None = None,
+        page_sizes: PageSizes | None = None,
+        slices: int = 1,
+        slice_field: str = "updatedAt",
+        checkpoint: "Checkpoint | None" = None,
+        first_page: dict[str, Any] | None = None,
     ) -> Iterator[dict[str, Any]]:
-        variables: dict[str, Any] = {}
-        if latest is not None and self.entity_type in latest:
-            variables["filter"] = {"updatedAt": {"gt": latest[self.entity_type]}}
-        max_updated: str | None = None
-        for node in client.paginate(self.query, self.connection_path, variables):
-            updated_at: str | None = node.get("updatedAt")
-            if updated_at is not None:
-                if max_updated is None or updated_at > max_updated:
-                    max_updated = updated_at
-            yield node
+        """
+        Yield every node of this export's connection, updated since ``latest``
+        if supplied. With more than one slice, the connection is split into
+        that many ``slice_field`` ranges which are paginated concurrently.
+        Progress is recorded in the ``checkpoint`` once all the nodes of a page
+        have been consumed, and an export already in the checkpoint carries on
+        from where it got to. A ``first_page`` already fetched by
+        :func:`first_pages` is used instead of fetching it again.
+        """
+        state = checkpoint.entities.get(self.entity_type) if checkpoint is not None else None
+        if state is None:
+            state = {
+                "slices": [
+                    {"filter": f, "after": None, "done": False}
+                    for f in self._slices(latest, slices, slice_field)
+                ],
+                "max_updated": None,
+            }
+            if checkpoint is not None:
+                checkpoint.start(self.entity_type, state)
+        page_size: int | PageSize = DEFAULT_PAGE_SIZE
+        if page_sizes is not None:
+            page_size = PageSize(page_sizes.get(self.entity_type, DEFAULT_PAGE_SIZE))
+
+        def slice_pages(
+            index: int, slice_: dict[str, Any], read: bool
+        ) -> Iterator[tuple[int, Page]]:
+            variables: dict[str, Any] = {}
+            if slice_["filter"]:
+                variables["filter"] = slice_["filter"]
+            if slice_["after"] is not None:
+                variables["after"] = slice_["after"]
+            elif first_page is not None:
+                yield index, Page(first_page["nodes"], first_page["pageInfo"])
+                if not first_page["pageInfo"]["hasNextPage"]:
+                    return
+                variables["after"] = first_page["pageInfo"]["endCursor"]
+            pages = client.stream_pages(self.query, self.connection_path, variables, page_size)
+            for page in pages:
+                if read:
+                    # The page is used on another thread, so must be decoded here:
+                    page = Page(list(page.nodes), page.page_info)
+                yield index, page
+
+        remaining = [(i, slice_) for i, slice_ in enumerate(state["slices"]) if not slice_["done"]]
+        read = len(remaining) > 1
+        streams = [slice_pages(index, slice_, read) for index, slice_ in remaining]
+        pages = merged(streams) if read else chain.from_iterable(streams)
+        nested = nested_connections(self.fields)
+        max_updated: str | None = state["max_updated"]
+        for index, page in pages:
+            nodes = page.nodes
+            if nested:
+                nodes = list(nodes)
+                self._complete(client, nodes)
+            for node in nodes:
+                updated_at: str | None = node.get("updatedAt")
+                if updated_at is not None:
+                    if max_updated is None or updated_at > max_updated:
+                        max_updated = updated_at
+                yield node
+            if checkpoint is not None:
+                page_info = page.page_info
+                checkpoint.commit(
+                    self.entity_type,
+                    index,
+                    page_info["endCursor"],
+                    not page_info["hasNextPage"],
+                    max_updated,
+                )
         if latest is not None and max_updated is not None:
             latest[self.entity_type] = max_updated
+        if page_sizes is not None and isinstance(page_size, PageSize):
+            page_sizes[self.entity_type] = page_size.size
+
+    def _complete(self, client: LinearClient, nodes: list[dict[str, Any]]) -> None:
+        """
+        Fetch the rest of each nested connection that did not fit in the first
+        page of it returned with its node, and drop the nested ``pageInfo``.
+        """
+        for name, selection in nested_connections(self.fields):
+            truncated: list[tuple[dict[str, Any], str]] = []
+            for node in nodes:
+                page_info = node.get(name, {}).pop("pageInfo", None)
+                if page_info is not None and page_info["hasNextPage"]:
+                    truncated.append((node, page_info["endCursor"]))
+            while truncated:
+                batch = truncated[:NESTED_BATCH_SIZE]
+                truncated = truncated[NESTED_BATCH_SIZE:]
+                query = build_nested_query(self.connection_path[:-1], name, selection, len(batch))
+                variables: dict[str, Any] = {"first": MAX_PAGE_SIZE}
+                for n, (node, after) in enumerate(batch):
+                    variables[f"id{n}"] = node["id"]
+                    variables[f"after{n}"] = after
+                result = client.query(query, variables)
+                for n, (node, _) in enumerate(batch):
+                    page = result[f"n{n}"][name]
+                    node[name]["nodes"].extend(page["nodes"])
+                    if page["pageInfo"]["hasNextPage"]:
+                        truncated.append((node, page["pageInfo"]["endCursor"]))
+
+    def profiled(self, profile: str) -> "Export":
+        """
+        Return this export with a query selecting only the fields in ``profile``.
+        """
+        selected = PROFILES[profile]
+        return replace(self, fields=tuple(f for f in self.fields if selected(self, f)))
+
+    def ids(self, client: LinearClient) -> Iterator[str]:
+        """
+        Yield the id of every node currently in this export's connection.
+        """
+        query = ids_query(self.connection_path)
+        for node in client.paginate(query, self.connection_path, page_size=MAX_PAGE_SIZE):
+            yield node["id"]
+
+
+def first_pages(
+    client: LinearClient,
+    exports: list[Export],
+    latest: LatestData | None = None,
+    page_sizes: PageSizes | None = None,
+) -> dict[str, dict[str, Any]]:
+    """
+    Fetch the first page of each export's connection, as :meth:`Export.items`
+    would without slices, combined into as few requests as possible. The pages
+    are returned by entity type, leaving out any that were too large to fetch
+    together so they are fetched on their own as usual.
+    """
+    if len(exports) < 2:
+        return {}
+    variables: dict[str, Any] = {}
+    for n, exp in enumerate(exports):
+        size = page_sizes.get(exp.entity_type) if page_sizes is not None else None
+        variables[f"first{n}"] = size or DEFAULT_PAGE_SIZE
+        filter_ = exp._slices(latest, 1, "updatedAt")[0]
+        if filter_:
+            variables[f"filter{n}"] = filter_
+    query = build_batch_query([(exp.connection_path, exp.fields) for exp in exports])
+    try:
+        result = client.query(query, variables)
+    except (LinearAPIError, httpx.TimeoutException) as e:
+        if not too_large(e):
+            raise
+        # Too much for one request, so try each half separately:
+        logger.debug("Could not fetch %d first pages together: %s", len(exports), e)
+        half = len(exports) // 2
+        return {
+            **first_pages(client, exports[:half], latest, page_sizes),
+            **first_pages(client, exports[half:], latest, page_sizes),
+        }
+    return {exp.entity_type: result[f"c{n}"] for n, exp in enumerate(exports)}
+
+
+def _metadata(exp: Export, field: str) -> bool:
+    # Leave out markdown bodies and nested connections:
+    return field.split()[0] not in exp.markdown_fields and "nodes" not in field
+
+
+#: Which fields of an export each profile selects.
+PROFILES: dict[str, Callable[[Export, str], bool]] = {
+    "full": lambda exp, field: True,
+    "metadata": _metadata,
+}
+
+
+def check_profile(export_path: Path, profile: str) -> None:
+    """
+    Record the ``profile`` of the export in ``export_path``, raising a
+    :class:`ValueError` if it was exported to with a different profile,
+    whose entities and digests would be replaced.
+    """
+    path = export_path / "profile"
+    if path.exists():
+        recorded = path.read_text().strip()
+    elif (export_path / "latest.json").exists() or (export_path / "hashes").exists():
+        # Exported before profiles were recorded, when every field was:
+        recorded = "full"
+    else:
+        recorded = profile
+    if recorded != profile:
+        raise ValueError(
+            f"{export_path} was exported with the {recorded!r} profile, "
+            f"use a different --path for the {profile!r} profile"
+        )
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, f"{profile}\n".encode())
+
+
+class Checkpoint:
+    """
+    The progress of an export, saved to ``path`` at most every ``interval``
+    seconds so that an interrupted export can be resumed from the last page
+    that was completely written.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = CHECKPOINT_INTERVAL,
+        entities: dict[str, dict[str, Any]] | None = None,
+        downloads: list[tuple[str, str]] | None = None,
+    ) -> None:
+        self.path = path
+        self.interval = interval
+        #: For each entity type, the filter, cursor and completion of each slice,
+        #: along with the most recent ``updatedAt`` seen.
+        self.entities: dict[str, dict[str, Any]] = entities or {}
+        #: Files that were found but not yet downloaded when the checkpoint was loaded.
+        self.downloads: list[tuple[str, str]] = downloads or []
+        #: Called before saving, to make durable everything the checkpoint covers.
+        self.before_save: Callable[[], None] | None = None
+        #: Returns the files found so far that have not yet been downloaded.
+        self.pending_downloads: Callable[[], list[tuple[str, str]]] | None = None
+        #: Whether to sync the checkpoint to disk each time it is saved.
+        self.sync = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_at = time.monotonic()
+
+    @classmethod
+    def load(cls, path: Path, interval: float = CHECKPOINT_INTERVAL) -> "Checkpoint":
+        if not path.exists():
+            return cls(path, interval)
+        data = json.loads(path.read_text())
+        downloads = [(name, url) for name, url in data["downloads"]]
+        return cls(path, interval, data["entities"], downloads)
+
+    def start(self, entity_type: str, state: dict[str, Any]) -> None:
+        with self._lock:
+            self.entities[entity_type] = state
+
+    def commit(
+        self,
+        entity_type: str,
+        index: int,
+        after: str | None,
+        done: bool,
+        max_updated: str | None,
+    ) -> None:
+        with self._lock:
+            state = self.entities[entity_type]
+            state["slices"][index].update(after=after, done=done)
+            state["max_updated"] = max_updated
+            due = time.monotonic() - self._saved_at >= self.interval
+        if due:
+            self.save()
+
+    def save(self) -> None:
+        with self._save_lock:
+            # Take the snapshot first, so everything it covers has been written
+            # before before_save makes it durable.
+            with self._lock:
+                entities = json.loads(json.dumps(self.entities))
+                self._saved_at = time.monotonic()
+            if self.before_save is not None:
+                self.before_save()
+            downloads = self.pending_downloads() if self.pending_downloads is not None else []
+            data = {"entities": entities, "downloads": downloads}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.path, (json.dumps(data, indent=2) + "\n").encode(), self.sync)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
 
 
 EXPORTS: dict[str, Export] = {
     "teams": Export(
         entity_type="teams",
-        query=TEAMS,
         connection_path="teams",
+        batched=True,
     ),
     "users": Export(
         entity_type="users",
-        query=USERS,
         connection_path="users",
+        batched=True,
     ),
     "issues": Export(
         entity_type="issues",
-        query=ISSUES,
         connection_path="issues",
         markdown_fields=("description",),
     ),
     "comments": Export(
         entity_type="comments",
-        query=COMMENTS,
         connection_path="comments",
         markdown_fields=("body",),
     ),
     "projects": Export(
         entity_type="projects",
-        query=PROJECTS,
         connection_path="projects",
         markdown_fields=("description",),
     ),
     "initiatives": Export(
         entity_type="initiatives",
-        query=INITIATIVES,
         connection_path="initiatives",
         markdown_fields=("description",),
     ),
     "cycles": Export(
         entity_type="cycles",
-        query=CYCLES,
         connection_path="cycles",
         markdown_fields=("description",),
     ),
     "issue_labels": Export(
         entity_type="issue_labels",
-        query=ISSUE_LABELS,
         connection_path="issueLabels",
+        batched=True,
     ),
     "documents": Export(
         entity_type="documents",
-        query=DOCUMENTS,
         connection_path="documents",
         markdown_fields=("content",),
     ),
     "workflow_states": Export(
         entity_type="workflow_states",
-        query=WORKFLOW_STATES,
         connection_path="workflowStates",
+        batched=True,
     ),
     "attachments": Export(
         entity_type="attachments",
-        query=ATTACHMENTS,
         connection_path="attachments",
     ),
     "project_milestones": Export(
         entity_type="project_milestones",
-        query=PROJECT_MILESTONES,
         connection_path="projectMilestones",
         markdown_fields=("description",),
+        batched=True,
     ),
 }
@@ -1,15 +1,42 @@
 import json
 import logging
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from pathlib import Path
 
 import click
 import enlighten
 
-from .client import LinearClient, client_from_auth
-from .downloads import download_all, extract_upload_urls
+from .client import MAX_RETRIES, LinearClient, client_from_auth
+from .downloads import Downloader, UrlIndex
 from .exceptions import LinearAPIError
-from .export import EXPORTS, LatestData, write_entity
+from .export import (
+    CHECKPOINT_INTERVAL,
+    EXPORTS,
+    FSYNC_POLICIES,
+    PROFILES,
+    Checkpoint,
+    Export,
+    LatestData,
+    PageSizes,
+    check_profile,
+    first_pages,
+)
 from .queries import VIEWER
+from .reconcile import MODES, Tombstones, reconcile
+from .storage import FORMATS, WriteBehind
+
+
+def parse_slices(
+    ctx: click.Context, param: click.Parameter, values: tuple[str, ...]
+) -> dict[str, int]:
+    slices: dict[str, int] = {}
+    for value in values:
+        name, sep, count = value.partition('=')
+        if not sep or not count.isdigit() or int(count) < 1:
+            raise click.BadParameter(f"Expected ENTITY=N, got {value!r}")
+        slices[name] = int(count)
+    return slices
 
 
 @click.group()
@@ -81,12 +108,156 @@ def whoami(ctx: click.Context) -> None:
     is_flag=True,
     help='Incremental update mode using latest.json cursors.',
 )
+@click.option(
+    '--concurrency',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of entity types to export in parallel.',
+)
+@click.option(
+    '--download-workers',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of files to download in parallel.',
+)
+@click.option(
+    '--dedup-files',
+    is_flag=True,
+    help='Store the content of identical files once, hard linked to from each location.',
+)
+@click.option(
+    '--write-workers',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help='Number of threads writing exported entities in the background.',
+)
+@click.option(
+    '--max-retries',
+    type=click.IntRange(min=1),
+    default=MAX_RETRIES,
+    show_default=True,
+    help='Number of attempts for each request when rate limited.',
+)
+@click.option(
+    '--slices',
+    metavar='ENTITY=N',
+    multiple=True,
+    callback=parse_slices,
+    help='Split an entity type into N time ranges that are fetched in parallel.',
+)
+@click.option(
+    '--slice-field',
+    type=click.Choice(['updatedAt', 'createdAt']),
+    default='updatedAt',
+    show_default=True,
+    help='Timestamp used to split entity types given to --slices.',
+)
+@click.option(
+    '--format',
+    'format_',
+    type=click.Choice(list(FORMATS)),
+    default='files',
+    show_default=True,
+    help='How exported entities are stored.',
+)
+@click.option(
+    '--fsync',
+    type=click.Choice(FSYNC_POLICIES),
+    default='never',
+    show_default=True,
+    help='When written files are synced to disk: "batch" syncs them a page at a time '
+    'and before each checkpoint, "always" syncs every file as it is written.',
+)
+@click.option(
+    '--resume',
+    is_flag=True,
+    help='Continue an interrupted export from its last checkpoint.',
+)
+@click.option(
+    '--checkpoint-interval',
+    type=click.FloatRange(min=0),
+    default=CHECKPOINT_INTERVAL,
+    show_default=True,
+    help='Seconds between saving checkpoints of export progress.',
+)
+@click.option(
+    '--reconcile',
+    'reconcile_mode',
+    type=click.Choice(MODES),
+    help='After exporting, find stored entities that have been deleted or archived in '
+    'Linear and record them in tombstones.jsonl, also removing them with "remove".',
+)
+@click.option(
+    '--profile',
+    type=click.Choice(list(PROFILES)),
+    default='full',
+    show_default=True,
+    help='Which fields of each entity to export.',
+)
+@click.option(
+    '--http2/--no-http2',
+    default=None,
+    help='Multiplex requests over HTTP/2 connections.',
+)
+@click.option(
+    '--api-connections',
+    type=click.IntRange(min=1),
+    help='Most connections open at once to the Linear API.',
+)
+@click.option(
+    '--upload-connections',
+    type=click.IntRange(min=1),
+    help='Most connections open at once for downloading files.',
+)
+@click.option(
+    '--keepalive-expiry',
+    type=click.FloatRange(min=0),
+    help='Seconds an idle connection is kept open for reuse.',
+)
+@click.option(
+    '--connect-timeout',
+    type=click.FloatRange(min=0),
+    help='Seconds to wait for a connection to be made.',
+)
+@click.option(
+    '--read-timeout',
+    type=click.FloatRange(min=0),
+    help='Seconds to wait for data from a connection.',
+)
+@click.option(
+    '--download-chunk-size',
+    type=click.IntRange(min=1),
+    help='Bytes of a downloaded file read and written at a time.',
+)
 @click.pass_context
 def export(
     ctx: click.Context,
     entities: tuple[str, ...],
     export_path: Path,
     update: bool,
+    concurrency: int,
+    download_workers: int,
+    dedup_files: bool,
+    write_workers: int,
+    max_retries: int,
+    slices: dict[str, int],
+    slice_field: str,
+    format_: str,
+    fsync: str,
+    resume: bool,
+    checkpoint_interval: float,
+    reconcile_mode: str | None,
+    profile: str,
+    http2: bool | None,
+    api_connections: int | None,
+    upload_connections: int | None,
+    keepalive_expiry: float | None,
+    connect_timeout: float | None,
+    read_timeout: float | None,
+    download_chunk_size: int | None,
 ) -> None:
     """
     Export data from Linear.
@@ -94,9 +265,30 @@ def export(
     Optionally specify entity types to export (e.g. issues comments).
     If none specified, all entity types are exported.
     """
-    client = client_from_auth(ctx.obj)
+    settings = {
+        'http2': http2,
+        'api_connections': api_connections,
+        'upload_connections': upload_connections,
+        'keepalive_expiry': keepalive_expiry,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'download_chunk_size': download_chunk_size,
+    }
+    transport = {name: value for name, value in settings.items() if value is not None}
+    try:
+        client = client_from_auth(ctx.obj, max_retries, transport)
+    except RuntimeError as e:
+        raise click.ClickException(str(e)) from e
     latest_path = export_path / "latest.json"
     latest = LatestData.load(latest_path) if update else LatestData()
+    page_sizes_path = export_path / "page_sizes.json"
+    page_sizes = PageSizes.load(page_sizes_path)
+    checkpoint_path = export_path / "checkpoint.json"
+    if resume:
+        checkpoint = Checkpoint.load(checkpoint_path, checkpoint_interval)
+    else:
+        checkpoint = Checkpoint(checkpoint_path, checkpoint_interval)
+    checkpoint.sync = fsync != 'never'
 
     exports_to_run = EXPORTS
     if entities:
@@ -104,31 +296,131 @@ def export(
         if unknown:
             raise click.BadParameter(f"Unknown entities: {', '.join(sorted(unknown))}")
         exports_to_run = {name: EXPORTS[name] for name in entities}
+    exports_to_run = {name: exp.profiled(profile) for name, exp in exports_to_run.items()}
+    unknown = set(slices) - set(EXPORTS)
+    if unknown:
+        raise click.BadParameter(f"Unknown entities: {', '.join(sorted(unknown))}")
+    try:
+        check_profile(export_path, profile)
+    except ValueError as e:
+        raise click.ClickException(str(e)) from e
+    try:
+        storage = FORMATS[format_](export_path, fsync=fsync)
+    except RuntimeError as e:
+        raise click.ClickException(str(e)) from e
+
+    prefetched = first_pages(
+        client,
+        [
+            exp
+            for name, exp in exports_to_run.items()
+            if exp.batched
+            and slices.get(name, 1) == 1
+            and exp.entity_type not in checkpoint.entities
+        ],
+        latest,
+        page_sizes,
+    )
+    tombstones = Tombstones(export_path / "tombstones.jsonl")
+    url_index = UrlIndex(export_path / "urls")
+    missing: dict[str, int] = {}
 
-    all_upload_urls: list[tuple[str, str]] = []
     manager = enlighten.get_manager()
+    progress_lock = threading.Lock()
+    # Set when the export has failed, so that exports still running give up:
+    stop = threading.Event()
 
-    try:
-        for name, exp in exports_to_run.items():
+    def export_one(name: str, exp: Export, writer: WriteBehind, downloader: Downloader) -> None:
+        with progress_lock:
             counter = manager.counter(desc=name, unit="entities")
-            for entity in exp.items(client, latest):
-                write_entity(export_path, exp.entity_type, entity)
-                for field_name in exp.markdown_fields:
-                    text: str | None = entity.get(field_name)
-                    if text:
-                        all_upload_urls.extend(extract_upload_urls(text))
+        items = exp.items(
+            client,
+            latest,
+            page_sizes,
+            slices.get(name, 1),
+            slice_field,
+            checkpoint,
+            prefetched.get(name),
+        )
+        for entity in items:
+            if stop.is_set():
+                return
+            writer.submit(exp.entity_type, entity)
+            uploads = url_index.new_urls(exp.entity_type, entity, exp.markdown_fields)
+            for display_name, url in uploads:
+                downloader.submit(display_name, url)
+            with progress_lock:
                 counter.update()
+        with progress_lock:
             counter.close()
+        if reconcile_mode is not None:
+            writer.flush()
+            missing[name] = len(reconcile(client, exp, storage, tombstones, reconcile_mode))
+
+    try:
+        download_counter = manager.counter(desc="files", unit="files")
+
+        def downloaded() -> None:
+            with progress_lock:
+                download_counter.update()
+
+        with (
+            storage,
+            WriteBehind(storage, write_workers) as writer,
+            Downloader(
+                client,
+                export_path / "files",
+                download_workers,
+                progress=downloaded,
+                dedup=dedup_files,
+                failed=url_index.failed,
+                succeeded=url_index.succeeded,
+            ) as downloader,
+        ):
+
+            def flush() -> None:
+                writer.flush()
+                storage.flush()
 
-        if all_upload_urls:
-            files_dir = export_path / "files"
-            download_counter = manager.counter(
-                desc="files", unit="files", total=len(all_upload_urls)
-            )
-            download_all(client, all_upload_urls, files_dir)
-            download_counter.update(len(all_upload_urls))
-            download_counter.close()
+            checkpoint.before_save = flush
+            checkpoint.pending_downloads = downloader.pending
+            for display_name, url in checkpoint.downloads:
+                downloader.submit(display_name, url)
+            executor = None
+            try:
+                if concurrency == 1:
+                    for name, exp in exports_to_run.items():
+                        export_one(name, exp, writer, downloader)
+                else:
+                    executor = ThreadPoolExecutor(max_workers=concurrency)
+                    futures = [
+                        executor.submit(export_one, name, exp, writer, downloader)
+                        for name, exp in exports_to_run.items()
+                    ]
+                    done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                    for future in done:
+                        future.result()
+            except BaseException:
+                stop.set()
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+                # Record everything that was completed before the failure:
+                checkpoint.save()
+                raise
+            if executor is not None:
+                executor.shutdown()
+        download_counter.close()
     finally:
         manager.stop()
 
-    latest.save(latest_path)
+    latest.save(latest_path, checkpoint.sync)
+    # Only saved once every file found has been downloaded or has failed, so
+    # that if an export fails, files it did not get to are found again:
+    url_index.save(checkpoint.sync)
+    page_sizes.save(page_sizes_path, checkpoint.sync)
+    checkpoint.remove()
+    for name in exports_to_run:
+        summary = f"{name}: {storage.written[name]} written, {storage.unchanged[name]} unchanged"
+        if reconcile_mode is not None:
+            summary += f", {missing[name]} missing"
+        click.echo(summary)
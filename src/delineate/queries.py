@@ -1,3 +1,6 @@
+import re
+from collections.abc import Iterable, Sequence
+
 VIEWER = """
 query {
     viewer {
@@ -8,269 +11,298 @@ query {
 }
 """
 
-TEAMS = """
-query($first: Int!, $after: String, $filter: TeamFilter) {
-    teams(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            key
-            description
-            color
-            icon
-            private
-            timezone
-            createdAt
-            updatedAt
-            archivedAt
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
+NESTED_CONNECTION = re.compile(r"(\w+) \{ nodes \{ (.+) \} pageInfo \{ hasNextPage endCursor \} \}")
 
-USERS = """
-query($first: Int!, $after: String, $filter: UserFilter) {
-    users(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            email
-            displayName
-            avatarUrl
-            active
-            admin
-            guest
-            createdAt
-            updatedAt
-            archivedAt
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
 
-ISSUES = """
-query($first: Int!, $after: String, $filter: IssueFilter) {
-    issues(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            identifier
-            title
-            description
-            priority
-            priorityLabel
-            estimate
-            sortOrder
-            boardOrder
-            url
-            branchName
-            dueDate
-            trashed
-            createdAt
-            updatedAt
-            completedAt
-            canceledAt
-            archivedAt
-            state { id name type color }
-            assignee { id name email }
-            creator { id name email }
-            team { id name key }
-            project { id name }
-            cycle { id name number }
-            parent { id identifier }
-            labels { nodes { id name color } }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
+def nested_connection(name: str, selection: str) -> str:
+    """
+    A field selecting the first page of a connection on each node.
+    """
+    return f"{name} {{ nodes {{ {selection} }} pageInfo {{ hasNextPage endCursor }} }}"
 
-COMMENTS = """
-query($first: Int!, $after: String, $filter: CommentFilter) {
-    comments(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            body
-            url
-            createdAt
-            updatedAt
-            archivedAt
-            issue { id identifier }
-            user { id name email }
-            parent { id }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
 
-PROJECTS = """
-query($first: Int!, $after: String, $filter: ProjectFilter) {
-    projects(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            description
-            state
-            progress
-            health
-            url
-            startDate
-            targetDate
-            createdAt
-            updatedAt
-            completedAt
-            canceledAt
-            archivedAt
-            lead { id name email }
-            teams { nodes { id name key } }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
+def nested_connections(fields: Iterable[str]) -> list[tuple[str, str]]:
+    """
+    Return the name and node selection of each nested connection in ``fields``.
+    """
+    return [
+        (match[1], match[2]) for field in fields if (match := NESTED_CONNECTION.fullmatch(field))
+    ]
 
-INITIATIVES = """
-query($first: Int!, $after: String, $filter: InitiativeFilter) {
-    initiatives(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            description
-            status
-            color
-            icon
-            sortOrder
-            createdAt
-            updatedAt
-            archivedAt
-            owner { id name email }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
-"""
 
-CYCLES = """
-query($first: Int!, $after: String, $filter: CycleFilter) {
-    cycles(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            number
-            description
-            startsAt
-            endsAt
-            progress
-            createdAt
-            updatedAt
-            archivedAt
-            team { id name key }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
+#: The selection for each node of each connection, one field per entry.
+FIELDS: dict[str, tuple[str, ...]] = {
+    "teams": (
+        "id",
+        "name",
+        "key",
+        "description",
+        "color",
+        "icon",
+        "private",
+        "timezone",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+    ),
+    "users": (
+        "id",
+        "name",
+        "email",
+        "displayName",
+        "avatarUrl",
+        "active",
+        "admin",
+        "guest",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+    ),
+    "issues": (
+        "id",
+        "identifier",
+        "title",
+        "description",
+        "priority",
+        "priorityLabel",
+        "estimate",
+        "sortOrder",
+        "boardOrder",
+        "url",
+        "branchName",
+        "dueDate",
+        "trashed",
+        "createdAt",
+        "updatedAt",
+        "completedAt",
+        "canceledAt",
+        "archivedAt",
+        "state { id name type color }",
+        "assignee { id name email }",
+        "creator { id name email }",
+        "team { id name key }",
+        "project { id name }",
+        "cycle { id name number }",
+        "parent { id identifier }",
+        nested_connection("labels", "id name color"),
+    ),
+    "comments": (
+        "id",
+        "body",
+        "url",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "issue { id identifier }",
+        "user { id name email }",
+        "parent { id }",
+    ),
+    "projects": (
+        "id",
+        "name",
+        "description",
+        "state",
+        "progress",
+        "health",
+        "url",
+        "startDate",
+        "targetDate",
+        "createdAt",
+        "updatedAt",
+        "completedAt",
+        "canceledAt",
+        "archivedAt",
+        "lead { id name email }",
+        nested_connection("teams", "id name key"),
+    ),
+    "initiatives": (
+        "id",
+        "name",
+        "description",
+        "status",
+        "color",
+        "icon",
+        "sortOrder",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "owner { id name email }",
+    ),
+    "cycles": (
+        "id",
+        "name",
+        "number",
+        "description",
+        "startsAt",
+        "endsAt",
+        "progress",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "team { id name key }",
+    ),
+    "issueLabels": (
+        "id",
+        "name",
+        "description",
+        "color",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "team { id name }",
+        "parent { id name }",
+    ),
+    "documents": (
+        "id",
+        "title",
+        "content",
+        "icon",
+        "color",
+        "url",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "project { id name }",
+        "creator { id name email }",
+    ),
+    "workflowStates": (
+        "id",
+        "name",
+        "type",
+        "color",
+        "position",
+        "description",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "team { id name key }",
+    ),
+    "attachments": (
+        "id",
+        "title",
+        "subtitle",
+        "url",
+        "metadata",
+        "groupBySource",
+        "source",
+        "sourceType",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "issue { id identifier }",
+        "creator { id name email }",
+    ),
+    "projectMilestones": (
+        "id",
+        "name",
+        "description",
+        "targetDate",
+        "sortOrder",
+        "createdAt",
+        "updatedAt",
+        "archivedAt",
+        "project { id name }",
+    ),
 }
-"""
 
-ISSUE_LABELS = """
-query($first: Int!, $after: String, $filter: IssueLabelFilter) {
-    issueLabels(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            description
-            color
-            createdAt
-            updatedAt
-            archivedAt
-            team { id name }
-            parent { id name }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
+
+def _filter_type(connection_path: str) -> str:
+    # Every connection is plural and filtered by a type named after its node:
+    return connection_path[0].upper() + connection_path[1:-1] + "Filter"
+
+
+def _connection(
+    connection_path: str, fields: Iterable[str], arguments: str, alias: str = ""
+) -> str:
+    selections = "".join(f"            {field}\n" for field in fields)
+    return f"""\
+    {alias}{connection_path}({arguments}) {{
+        nodes {{
+{selections}        }}
+        pageInfo {{ hasNextPage endCursor }}
+    }}
 """
 
-DOCUMENTS = """
-query($first: Int!, $after: String, $filter: DocumentFilter) {
-    documents(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            title
-            content
-            icon
-            color
-            url
-            createdAt
-            updatedAt
-            archivedAt
-            project { id name }
-            creator { id name email }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
+
+def build_query(connection_path: str, fields: Iterable[str]) -> str:
+    """
+    A query for a page of a connection, selecting ``fields`` from each node.
+    """
+    connection = _connection(
+        connection_path, fields, "first: $first, after: $after, filter: $filter"
+    )
+    return f"""
+query($first: Int!, $after: String, $filter: {_filter_type(connection_path)}) {{
+{connection}}}
 """
 
-WORKFLOW_STATES = """
-query($first: Int!, $after: String, $filter: WorkflowStateFilter) {
-    workflowStates(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            type
-            color
-            position
-            description
-            createdAt
-            updatedAt
-            archivedAt
-            team { id name key }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
+
+def build_batch_query(connections: Sequence[tuple[str, Iterable[str]]]) -> str:
+    """
+    A query for the first page of several connections at once. The variables
+    and result for the ``n``th connection are suffixed with ``n``, so its page
+    size is ``firstN``, its filter is ``filterN`` and its page is ``cN``.
+    """
+    parameters = []
+    selections = []
+    for n, (connection_path, fields) in enumerate(connections):
+        parameters.append(f"$first{n}: Int!, $filter{n}: {_filter_type(connection_path)}")
+        arguments = f"first: $first{n}, filter: $filter{n}"
+        selections.append(_connection(connection_path, fields, arguments, f"c{n}: "))
+    return f"""
+query({", ".join(parameters)}) {{
+{"".join(selections)}}}
 """
 
-ATTACHMENTS = """
-query($first: Int!, $after: String, $filter: AttachmentFilter) {
-    attachments(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            title
-            subtitle
-            url
-            metadata
-            groupBySource
-            source
-            sourceType
-            createdAt
-            updatedAt
-            archivedAt
-            issue { id identifier }
-            creator { id name email }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
+
+TEAMS = build_query("teams", FIELDS["teams"])
+USERS = build_query("users", FIELDS["users"])
+ISSUES = build_query("issues", FIELDS["issues"])
+COMMENTS = build_query("comments", FIELDS["comments"])
+PROJECTS = build_query("projects", FIELDS["projects"])
+INITIATIVES = build_query("initiatives", FIELDS["initiatives"])
+CYCLES = build_query("cycles", FIELDS["cycles"])
+ISSUE_LABELS = build_query("issueLabels", FIELDS["issueLabels"])
+DOCUMENTS = build_query("documents", FIELDS["documents"])
+WORKFLOW_STATES = build_query("workflowStates", FIELDS["workflowStates"])
+ATTACHMENTS = build_query("attachments", FIELDS["attachments"])
+PROJECT_MILESTONES = build_query("projectMilestones", FIELDS["projectMilestones"])
+
+
+def build_nested_query(node_field: str, connection: str, selection: str, count: int) -> str:
+    """
+    A query for the next page of a nested connection on ``count`` nodes at once.
+    The id and cursor for the ``n``th node are ``idN`` and ``afterN``, and its
+    result is ``nN``.
+    """
+    parameters = "".join(f", $id{n}: String!, $after{n}: String" for n in range(count))
+    selections = "".join(
+        f"""\
+    n{n}: {node_field}(id: $id{n}) {{
+        {connection}(first: $first, after: $after{n}) {{
+            nodes {{ {selection} }}
+            pageInfo {{ hasNextPage endCursor }}
+        }}
+    }}
+"""
+        for n in range(count)
+    )
+    return f"""
+query($first: Int!{parameters}) {{
+{selections}}}
 """
 
-PROJECT_MILESTONES = """
-query($first: Int!, $after: String, $filter: ProjectMilestoneFilter) {
-    projectMilestones(first: $first, after: $after, filter: $filter) {
-        nodes {
-            id
-            name
-            description
-            targetDate
-            sortOrder
-            createdAt
-            updatedAt
-            archivedAt
-            project { id name }
-        }
-        pageInfo { hasNextPage endCursor }
-    }
-}
+
+def ids_query(connection_path: str) -> str:
+    """
+    A query for just the ids of every node in a connection, which is far
+    cheaper than the full query for the same connection.
+    """
+    return f"""
+query($first: Int!, $after: String) {{
+    {connection_path}(first: $first, after: $after) {{
+        nodes {{ id }}
+        pageInfo {{ hasNextPage endCursor }}
+    }}
+}}
 """
@@ -0,0 +1,92 @@
+import logging
+import random
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+#: The budgets Linear reports on every response, as ``X-RateLimit-{name}-*`` headers.
+BUDGETS = ("Requests", "Complexity")
+
+
+@dataclass
+class Budget:
+    limit: float
+    remaining: float
+    #: Wall-clock time, in seconds, at which the budget will be full again.
+    reset: float
+    #: Estimated cost of the next request against this budget.
+    cost: float = 1
+
+    def tokens(self, now: float) -> float:
+        if now >= self.reset:
+            return self.limit
+        return self.remaining
+
+    def refill_rate(self, now: float) -> float:
+        # Linear refills continuously, reaching the limit at the reset time.
+        return max(self.limit - self.remaining, 1) / max(self.reset - now, 1)
+
+
+@dataclass
+class RateLimiter:
+    """
+    A token bucket driven by the rate limit headers Linear returns, shared by
+    every caller of a client so that, together, they stay just under budget.
+    """
+
+    #: Fraction of each budget held back to absorb requests already in flight.
+    reserve: float = 0.05
+    budgets: dict[str, Budget] = field(default_factory=dict)
+    _lock: threading.Lock = field(init=False, repr=False, default_factory=threading.Lock)
+    _resume_at: float = field(init=False, repr=False, default=0.0)
+
+    def acquire(self) -> float:
+        """
+        Reserve capacity for one request, returning how long to wait before sending it.
+        """
+        with self._lock:
+            now = time.time()
+            delay = max(self._resume_at - now, 0)
+            for name, budget in self.budgets.items():
+                tokens = budget.tokens(now)
+                floor = budget.limit * self.reserve
+                if tokens - budget.cost < floor:
+                    wait = (floor + budget.cost - tokens) / budget.refill_rate(now)
+                    logger.debug("Pacing for %s budget: %.2fs", name, wait)
+                    delay = max(delay, wait)
+                budget.remaining = tokens - budget.cost
+            return delay
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """
+        Record the budgets reported in the headers of a response.
+        """
+        with self._lock:
+            for name in BUDGETS:
+                prefix = f"x-ratelimit-{name.lower()}-"
+                try:
+                    limit = float(headers[prefix + "limit"])
+                    remaining = float(headers[prefix + "remaining"])
+                    reset = float(headers[prefix + "reset"]) / 1000
+                except (KeyError, ValueError):
+                    continue
+                budget = self.budgets.get(name.lower())
+                cost = budget.cost if budget is not None else 1
+                self.budgets[name.lower()] = Budget(limit, remaining, reset, cost)
+            complexity = headers.get("x-complexity")
+            if complexity is not None and "complexity" in self.budgets:
+                self.budgets["complexity"].cost = float(complexity)
+
+    def back_off(self, attempt: int) -> float:
+        """
+        Pause every caller after a rate limited response, using exponential
+        backoff with jitter, and return the pause in seconds.
+        """
+        ceiling: float = 2**attempt
+        wait = random.uniform(ceiling / 2, ceiling)
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.time() + wait)
+        return wait
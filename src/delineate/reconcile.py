@@ -0,0 +1,63 @@
+import json
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+
+from .client import LinearClient
+from .export import Export, _timestamp
+from .storage import Storage
+
+#: What to do with stored entities that are no longer returned by Linear.
+MODES = ("tombstone", "remove")
+
+
+class Tombstones:
+    """
+    A record, in the JSON Lines file at ``path``, of each stored entity found
+    to have been deleted or archived in Linear.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._recorded: set[tuple[str, str]] = set()
+        if path.exists():
+            with path.open() as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._recorded.add((entry["entity_type"], entry["id"]))
+
+    def add(self, entity_type: str, uuid: str) -> None:
+        with self._lock:
+            if (entity_type, uuid) in self._recorded:
+                return
+            entry = {
+                "entity_type": entity_type,
+                "id": uuid,
+                "detectedAt": _timestamp(datetime.now(UTC)),
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(json.dumps(entry) + "\n")
+            self._recorded.add((entity_type, uuid))
+
+
+def reconcile(
+    client: LinearClient,
+    exp: Export,
+    storage: Storage,
+    tombstones: Tombstones,
+    mode: str = "tombstone",
+) -> list[str]:
+    """
+    Compare the ids in ``storage`` with those Linear currently returns for an
+    export, recording a tombstone for each stored entity that is missing and,
+    in ``remove`` mode, removing it from ``storage``. Returns the missing ids.
+    """
+    remote = set(exp.ids(client))
+    missing = sorted(storage.ids(exp.entity_type) - remote)
+    for uuid in missing:
+        tombstones.add(exp.entity_type, uuid)
+        if mode == "remove":
+            storage.remove(exp.entity_type, uuid)
+    return missing
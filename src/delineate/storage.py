@@ -0,0 +1,526 @@
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Callable
+from functools import partial
+from pathlib import Path
+from typing import IO, Any, Self, cast
+
+from .export import (
+    FSYNC_BATCH_SIZE,
+    HashIndex,
+    compact_json,
+    digest,
+    pretty_json,
+    sync_paths,
+    write_entity,
+)
+
+SQLITE_BATCH_SIZE = 1000
+SEGMENT_SIZE = 64 * 1024 * 1024
+WRITE_QUEUE_SIZE = 1000
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class Storage(ABC):
+    """
+    Where exported entities are written. Entities whose content has not
+    changed since they were last written are skipped and counted as unchanged.
+    ``fsync`` is one of :data:`~delineate.export.FSYNC_POLICIES`.
+    """
+
+    #: Name of the directory under ``hashes/`` for this storage's hash index.
+    kind: str
+
+    def __init__(self, base_dir: Path, fsync: str = "never") -> None:
+        self.base_dir = base_dir
+        self.fsync = fsync
+        self.hashes = HashIndex(base_dir / "hashes" / self.kind)
+        self.written: Counter[str] = Counter()
+        self.unchanged: Counter[str] = Counter()
+        self.removed: Counter[str] = Counter()
+        self._counts_lock = threading.Lock()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+        """
+        Write an entity, returning ``False`` if it was unchanged.
+        """
+        written = self._write(entity_type, entity)
+        with self._counts_lock:
+            (self.written if written else self.unchanged)[entity_type] += 1
+        return written
+
+    @abstractmethod
+    def _write(self, entity_type: str, entity: dict[str, Any]) -> bool: ...
+
+    def _changed(self, entity_type: str, uuid: str, data: bytes) -> str | None:
+        """
+        Return the digest of ``data`` if it differs from what was last written.
+        """
+        current = digest(data)
+        if self.hashes.get(entity_type, uuid) == current:
+            return None
+        return current
+
+    @abstractmethod
+    def get(self, entity_type: str, uuid: str) -> dict[str, Any] | None: ...
+
+    @abstractmethod
+    def ids(self, entity_type: str) -> set[str]:
+        """
+        Return the id of every entity of this type that is currently stored.
+        """
+
+    def remove(self, entity_type: str, uuid: str) -> None:
+        """
+        Remove an entity, so it is no longer returned by :meth:`get` or :meth:`ids`.
+        """
+        self._remove(entity_type, uuid)
+        self.hashes.discard(entity_type, uuid)
+        with self._counts_lock:
+            self.removed[entity_type] += 1
+
+    @abstractmethod
+    def _remove(self, entity_type: str, uuid: str) -> None: ...
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+        self.hashes.save(self.fsync != "never")
+
+
+class FileStorage(Storage):
+    """
+    One JSON file per entity, in ``entity_type/prefix/uuid.json``, either
+    pretty-printed or, if ``compact``, on a single line. When syncing in
+    batches, files are synced once ``FSYNC_BATCH_SIZE`` have been written
+    and whenever the storage is flushed.
+    """
+
+    kind = "files"
+
+    def __init__(self, base_dir: Path, compact: bool = False, fsync: str = "never") -> None:
+        super().__init__(base_dir, fsync)
+        self.serialize = compact_json if compact else pretty_json
+        self._directories: set[Path] = set()
+        self._unsynced: list[Path] = []
+        self._sync_lock = threading.Lock()
+
+    def _write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+        path = write_entity(
+            self.base_dir,
+            entity_type,
+            entity,
+            self.hashes,
+            self.serialize,
+            self._directories,
+            sync=self.fsync == "always",
+        )
+        if path is None:
+            return False
+        if self.fsync == "batch":
+            with self._sync_lock:
+                self._unsynced.append(path)
+                due = len(self._unsynced) >= FSYNC_BATCH_SIZE
+            if due:
+                self._sync()
+        return True
+
+    def _sync(self) -> None:
+        with self._sync_lock:
+            paths, self._unsynced = self._unsynced, []
+        sync_paths(paths)
+
+    def get(self, entity_type: str, uuid: str) -> dict[str, Any] | None:
+        path = self.base_dir / entity_type / uuid[:4] / f"{uuid}.json"
+        if not path.exists():
+            return None
+        entity: dict[str, Any] = json.loads(path.read_text())
+        return entity
+
+    def ids(self, entity_type: str) -> set[str]:
+        return {path.stem for path in (self.base_dir / entity_type).glob("*/*.json")}
+
+    def _remove(self, entity_type: str, uuid: str) -> None:
+        (self.base_dir / entity_type / uuid[:4] / f"{uuid}.json").unlink(missing_ok=True)
+
+    def flush(self) -> None:
+        self._sync()
+
+
+class SQLiteStorage(Storage):
+    """
+    A single ``export.sqlite`` database with one table per entity type,
+    written in batched transactions, which SQLite makes durable whatever ``fsync`` is.
+    """
+
+    kind = "sqlite"
+
+    def __init__(
+        self, base_dir: Path, batch_size: int = SQLITE_BATCH_SIZE, fsync: str = "never"
+    ) -> None:
+        super().__init__(base_dir, fsync)
+        self.batch_size = batch_size
+        base_dir.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(base_dir / "export.sqlite", check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        self._tables: set[str] = set()
+        self._pending: dict[str, list[tuple[str, str | None, str]]] = {}
+
+    def _table(self, entity_type: str) -> str:
+        if entity_type not in self._tables:
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{entity_type}" '
+                '(id TEXT PRIMARY KEY, updated_at TEXT, data TEXT NOT NULL)'
+            )
+            self._tables.add(entity_type)
+        return f'"{entity_type}"'
+
+    def _write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+        data = json.dumps(entity)
+        current = self._changed(entity_type, entity["id"], data.encode())
+        if current is None:
+            return False
+        row = (entity["id"], entity.get("updatedAt"), data)
+        with self._lock:
+            pending = self._pending.setdefault(entity_type, [])
+            pending.append(row)
+            if len(pending) >= self.batch_size:
+                self._flush()
+        self.hashes.set(entity_type, entity["id"], current)
+        return True
+
+    def _flush(self) -> None:
+        with self._connection:
+            for entity_type, rows in self._pending.items():
+                self._connection.executemany(
+                    f"INSERT OR REPLACE INTO {self._table(entity_type)} VALUES (?, ?, ?)", rows
+                )
+        self._pending.clear()
+
+    def get(self, entity_type: str, uuid: str) -> dict[str, Any] | None:
+        with self._lock:
+            self._flush()
+            row = self._connection.execute(
+                f"SELECT data FROM {self._table(entity_type)} WHERE id = ?", (uuid,)
+            ).fetchone()
+        if row is None:
+            return None
+        entity: dict[str, Any] = json.loads(row[0])
+        return entity
+
+    def ids(self, entity_type: str) -> set[str]:
+        with self._lock:
+            self._flush()
+            rows = self._connection.execute(f"SELECT id FROM {self._table(entity_type)}")
+            return {row[0] for row in rows}
+
+    def _remove(self, entity_type: str, uuid: str) -> None:
+        with self._lock:
+            self._flush()
+            with self._connection:
+                self._connection.execute(
+                    f"DELETE FROM {self._table(entity_type)} WHERE id = ?", (uuid,)
+                )
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        super().close()
+        self._connection.close()
+
+
+def _zstandard() -> Any:
+    try:
+        import zstandard
+    except ImportError:  # pragma: no cover
+        raise RuntimeError("zstd compression requires the zstandard package") from None
+    return zstandard
+
+
+def _open_segment(path: Path, write: bool, compression: str | None) -> IO[bytes]:
+    mode = "wb" if write else "rb"
+    if compression == "gzip":
+        return cast(IO[bytes], gzip.open(path, mode))
+    f = path.open(mode)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        if write:
+            return cast(IO[bytes], zstandard.ZstdCompressor().stream_writer(f, closefd=True))
+        return cast(IO[bytes], zstandard.ZstdDecompressor().stream_reader(f, closefd=True))
+    return f
+
+
+def _compression(path: Path) -> str | None:
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if compression is not None and path.name.endswith(suffix):
+            return compression
+    return None
+
+
+class _Segments:
+    def __init__(self, directory: Path, compression: str | None) -> None:
+        self.directory = directory
+        self.compression = compression
+        self.suffix = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+        directory.mkdir(parents=True, exist_ok=True)
+        existing = [int(p.name.split(".")[0]) for p in directory.glob("[0-9]*.jsonl*")]
+        self.number = max(existing, default=0)
+        self.segment: IO[bytes] | None = None
+        self.size = 0
+        #: Where the current content of each entity is, leaving out removed entities.
+        self.locations: dict[str, dict[str, Any]] = {}
+        index_path = directory / "index.jsonl"
+        if index_path.exists():
+            with index_path.open() as index:
+                for line in index:
+                    entry = json.loads(line)
+                    if entry["segment"] is None:
+                        self.locations.pop(entry["id"], None)
+                    else:
+                        self.locations[entry["id"]] = entry
+        self.index = index_path.open("a")
+
+    def path(self, number: int) -> Path:
+        return self.directory / f"{number:06d}{self.suffix}"
+
+    def append(self, uuid: str, line: bytes, segment_size: int) -> None:
+        if self.segment is None or self.size >= segment_size:
+            self.close_segment()
+            self.number += 1
+            self.segment = _open_segment(self.path(self.number), True, self.compression)
+            self.size = 0
+        self.segment.write(line)
+        entry = {
+            "id": uuid,
+            "segment": self.number,
+            "file": self.path(self.number).name,
+            "offset": self.size,
+            "length": len(line),
+        }
+        self.index.write(json.dumps(entry) + "\n")
+        self.locations[uuid] = entry
+        self.size += len(line)
+
+    def remove(self, uuid: str) -> None:
+        self.index.write(json.dumps({"id": uuid, "segment": None}) + "\n")
+        self.locations.pop(uuid, None)
+
+    def find(self, uuid: str) -> tuple[Path, dict[str, Any]] | None:
+        """
+        Return the segment holding the current content of an entity, and where in it that is.
+        """
+        location = self.locations.get(uuid)
+        if location is None:
+            return None
+        if location["segment"] == self.number and self.segment is not None:
+            # Make what has been written to the open segment readable:
+            self.segment.flush()
+        # Index entries written before segment file names were recorded
+        # can only be in segments with the current compression:
+        name = location.get("file") or self.path(location["segment"]).name
+        return self.directory / name, location
+
+    def flush(self, sync: bool = False) -> None:
+        if self.segment is not None:
+            self.segment.flush()
+            if sync:
+                os.fsync(self.segment.fileno())
+        self.index.flush()
+        if sync:
+            os.fsync(self.index.fileno())
+
+    def close_segment(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def close(self) -> None:
+        self.close_segment()
+        self.index.close()
+
+
+class JSONLStorage(Storage):
+    """
+    Append-only JSON Lines segments for each entity type, optionally compressed,
+    in ``entity_type/NNNNNN.jsonl``. Each segment is rolled over once it holds
+    ``segment_size`` uncompressed bytes, and ``entity_type/index.jsonl`` records
+    where in which segment each entity was written, most recent last. Removing
+    an entity appends an entry with no segment to the index, which is read once
+    for each entity type and then kept up to date in memory. Unless ``fsync`` is
+    ``never``, segments and indexes are synced each time the storage is flushed.
+    """
+
+    def __init__(
+        self,
+        base_dir: Path,
+        compression: str | None = None,
+        segment_size: int = SEGMENT_SIZE,
+        fsync: str = "never",
+    ) -> None:
+        self.compression = compression
+        self.kind = "jsonl" + COMPRESSION_SUFFIXES[compression]
+        super().__init__(base_dir, fsync)
+        self.segment_size = segment_size
+        if compression == "zstd":
+            _zstandard()
+        self._lock = threading.Lock()
+        self._segments: dict[str, _Segments] = {}
+
+    def _for(self, entity_type: str) -> _Segments:
+        segments = self._segments.get(entity_type)
+        if segments is None:
+            segments = _Segments(self.base_dir / entity_type, self.compression)
+            self._segments[entity_type] = segments
+        return segments
+
+    def _write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+        line = (json.dumps(entity, separators=(",", ":")) + "\n").encode()
+        current = self._changed(entity_type, entity["id"], line)
+        if current is None:
+            return False
+        with self._lock:
+            self._for(entity_type).append(entity["id"], line, self.segment_size)
+        self.hashes.set(entity_type, entity["id"], current)
+        return True
+
+    def get(self, entity_type: str, uuid: str) -> dict[str, Any] | None:
+        with self._lock:
+            found = self._for(entity_type).find(uuid)
+        if found is None:
+            return None
+        path, location = found
+        # The segment may have been written with a different --format:
+        with _open_segment(path, False, _compression(path)) as segment:
+            segment.seek(location["offset"])
+            entity: dict[str, Any] = json.loads(segment.read(location["length"]))
+        return entity
+
+    def ids(self, entity_type: str) -> set[str]:
+        with self._lock:
+            return set(self._for(entity_type).locations)
+
+    def _remove(self, entity_type: str, uuid: str) -> None:
+        with self._lock:
+            self._for(entity_type).remove(uuid)
+
+    def flush(self) -> None:
+        with self._lock:
+            for segments in self._segments.values():
+                segments.flush(self.fsync != "never")
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            for segments in self._segments.values():
+                segments.close()
+            self._segments.clear()
+        self.hashes.save(self.fsync != "never")
+
+
+class WriteBehind:
+    """
+    Writes entities to a storage on a pool of worker threads, fed through
+    bounded queues, so that fetching more entities overlaps with writing them.
+    Each entity is always written by the same worker, so writes of it stay in order.
+    """
+
+    def __init__(
+        self, storage: Storage, workers: int = 1, queue_size: int = WRITE_QUEUE_SIZE
+    ) -> None:
+        self.storage = storage
+        self._queues: list[queue.Queue[tuple[str, dict[str, Any]] | threading.Event | None]] = [
+            queue.Queue(maxsize=max(queue_size // workers, 1)) for _ in range(workers)
+        ]
+        self._error: BaseException | None = None
+        self._aborted = False
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), daemon=True) for q in self._queues
+        ]
+
+    def __enter__(self) -> Self:
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: object) -> None:
+        if exc_type is not None:
+            # Don't wait for queued writes when the producer has failed.
+            self._aborted = True
+            self._stop()
+        else:
+            self.close()
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, entity_type: str, entity: dict[str, Any]) -> None:
+        self._raise()
+        queue_ = self._queues[hash(entity["id"]) % len(self._queues)]
+        # Blocks when the workers fall behind, applying back-pressure to the producer.
+        queue_.put((entity_type, entity))
+
+    def flush(self) -> None:
+        """
+        Wait until every entity submitted so far has been written.
+        """
+        markers = []
+        for queue_ in self._queues:
+            marker = threading.Event()
+            queue_.put(marker)
+            markers.append(marker)
+        for marker in markers:
+            marker.wait()
+        self._raise()
+
+    def _stop(self) -> None:
+        for queue_ in self._queues:
+            queue_.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def close(self) -> None:
+        self._stop()
+        self._raise()
+
+    def _work(
+        self, queue_: queue.Queue[tuple[str, dict[str, Any]] | threading.Event | None]
+    ) -> None:
+        while (item := queue_.get()) is not None:
+            if isinstance(item, threading.Event):
+                item.set()
+            elif self._aborted or self._error is not None:
+                # Keep draining so producers are never blocked on a full queue.
+                continue
+            else:
+                try:
+                    self.storage.write(*item)
+                except BaseException as e:  # noqa: BLE001
+                    self._error = e
+
+
+FORMATS: dict[str, Callable[..., Storage]] = {
+    "files": FileStorage,
+    "files.compact": partial(FileStorage, compact=True),
+    "sqlite": SQLiteStorage,
+    "jsonl": JSONLStorage,
+    "jsonl.gz": partial(JSONLStorage, compression="gzip"),
+    "jsonl.zst": partial(JSONLStorage, compression="zstd"),
+}
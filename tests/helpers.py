@@ -1,5 +1,7 @@
+from collections.abc import Iterable, Iterator
 from typing import Any
 
+import httpx
 from click.testing import CliRunner, Result
 
 from delineate.main import cli
@@ -27,3 +29,15 @@ def make_paginated_response(
             }
         }
     }
+
+
+class Chunks(httpx.SyncByteStream):
+    """
+    A response body that arrives in ``chunks``, which may raise part way through.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.chunks = chunks
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.chunks
@@ -1,13 +1,30 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from collections.abc import Iterable, Iterator
+from datetime import timedelta
 from pathlib import Path
+from typing import Any
 
+import httpx
 import pytest
 from pytest_httpx import HTTPXMock
 from testfixtures import Replacer
 
-from delineate.client import LinearClient
+from delineate.client import (
+    MAX_PAGE_SIZE,
+    MIN_PAGE_SIZE,
+    AsyncLinearClient,
+    LinearClient,
+    PageSize,
+    Transport,
+    client_from_auth,
+)
 from delineate.exceptions import LinearAPIError
 
-from .helpers import make_paginated_response
+from .helpers import Chunks, make_paginated_response
 
 
 class TestQuery:
@@ -57,6 +74,55 @@ class TestQuery:
             with pytest.raises(LinearAPIError, match="Rate limited after max retries"):
                 client.query("{ viewer { id } }")
 
+    def test_rate_limit_shared_between_callers(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json={"errors": [{"message": "Rate limited", "extensions": {"code": "RATELIMITED"}}]},
+        )
+        httpx_mock.add_response(json={"data": {"viewer": {"id": "123"}}})
+        httpx_mock.add_response(json={"data": {"viewer": {"id": "456"}}})
+        client = LinearClient(api_key="lin_api_test")
+        sleeps: list[float] = []
+        with Replacer() as r:
+            r.replace("time.sleep", sleeps.append)
+            client.query("{ viewer { id } }")
+            # A later caller also waits for the backoff requested by the first:
+            client.query("{ viewer { id } }")
+        assert len(sleeps) == 2
+        assert all(0 < s <= 1 for s in sleeps)
+
+    def test_max_retries(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json={"errors": [{"message": "Rate limited", "extensions": {"code": "RATELIMITED"}}]},
+            is_reusable=True,
+        )
+        client = LinearClient(api_key="lin_api_test", max_retries=5)
+        with Replacer() as r:
+            r.replace("time.sleep", lambda x: None)
+            with pytest.raises(LinearAPIError, match="Rate limited after max retries"):
+                client.query("{ viewer { id } }")
+        assert len(httpx_mock.get_requests()) == 5
+
+    def test_paced_by_rate_limit_headers(self, httpx_mock: HTTPXMock) -> None:
+        reset = str(int((time.time() + 3600) * 1000))
+        httpx_mock.add_response(
+            json={"data": {"viewer": {"id": "123"}}},
+            headers={
+                "X-RateLimit-Requests-Limit": "1500",
+                "X-RateLimit-Requests-Remaining": "10",
+                "X-RateLimit-Requests-Reset": reset,
+            },
+        )
+        httpx_mock.add_response(json={"data": {"viewer": {"id": "123"}}})
+        client = LinearClient(api_key="lin_api_test")
+        sleeps: list[float] = []
+        with Replacer() as r:
+            r.replace("time.sleep", sleeps.append)
+            client.query("{ viewer { id } }")
+            assert sleeps == []
+            client.query("{ viewer { id } }")
+        assert len(sleeps) == 1
+        assert sleeps[0] > 0
+
     def test_graphql_error(self, httpx_mock: HTTPXMock) -> None:
         httpx_mock.add_response(
             json={"errors": [{"message": "Field 'foo' not found on type 'Query'"}]},
@@ -97,11 +163,505 @@ class TestPaginate:
         results = list(client.paginate("query", "issues"))
         assert results == [{"id": "1", "title": "First"}, {"id": "2", "title": "Second"}]
 
+    def test_adaptive_page_size(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json=make_paginated_response("issues", [{"id": "1"}], True, "cursor1"),
+            headers={"X-Complexity": "1000"},
+        )
+        httpx_mock.add_response(
+            json={"errors": [{"message": "Query too complex"}]},
+        )
+        httpx_mock.add_response(
+            json=make_paginated_response("issues", [{"id": "2"}]),
+            headers={"X-Complexity": "1000"},
+        )
+        client = LinearClient(api_key="lin_api_test")
+        page_size = PageSize(100)
+        results = list(client.paginate("query", "issues", page_size=page_size))
+        assert results == [{"id": "1"}, {"id": "2"}]
+        sizes = [json.loads(r.content)["variables"]["first"] for r in httpx_mock.get_requests()]
+        assert sizes == [100, 150, 75]
+        assert page_size.size == 112
+
+    def test_adaptive_page_size_timeout(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_exception(httpx.ReadTimeout("too slow"))
+        httpx_mock.add_response(json=make_paginated_response("issues", [{"id": "1"}]))
+        client = LinearClient(api_key="lin_api_test")
+        page_size = PageSize(40)
+        assert list(client.paginate("query", "issues", page_size=page_size)) == [{"id": "1"}]
+        sizes = [json.loads(r.content)["variables"]["first"] for r in httpx_mock.get_requests()]
+        assert sizes == [40, 20]
+
+    def test_adaptive_page_size_at_minimum(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json={"errors": [{"message": "Query too complex"}]})
+        client = LinearClient(api_key="lin_api_test")
+        with pytest.raises(LinearAPIError, match="Query too complex"):
+            list(client.paginate("query", "issues", page_size=PageSize(MIN_PAGE_SIZE)))
+
+    def test_adaptive_page_size_other_error(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json={"errors": [{"message": "Boom"}]})
+        client = LinearClient(api_key="lin_api_test")
+        page_size = PageSize(100)
+        with pytest.raises(LinearAPIError, match="Boom"):
+            list(client.paginate("query", "issues", page_size=page_size))
+        assert page_size.size == 100
+
+
+def _streaming_client(
+    chunks: Iterable[bytes], requests: list[httpx.Request], headers: dict[str, str] | None = None
+) -> LinearClient:
+    # pytest-httpx reads each response before returning it, so use a transport that does not:
+    def respond(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, headers=headers, stream=Chunks(chunks))
+
+    client = LinearClient(api_key="lin_api_test")
+    client._http = httpx.Client(transport=httpx.MockTransport(respond))
+    return client
+
+
+class TestStreamPages:
+    def test_nodes_decoded_as_they_arrive(self) -> None:
+        sent = []
+
+        def chunks() -> Iterator[bytes]:
+            body = json.dumps(
+                make_paginated_response("issues", [{"id": "1", "title": "caf\u00e9"}, {"id": "2"}]),
+                separators=(",", ":"),
+                ensure_ascii=False,
+            ).encode()
+            # Split within the prefix, a node and a multi-byte character:
+            for start, end in (0, 10), (10, 50), (50, 52), (52, 56), (56, None):
+                sent.append(body[start:end])
+                yield body[start:end]
+
+        client = _streaming_client(chunks(), [])
+        page = next(client.stream_pages("query", "issues"))
+        nodes = iter(page.nodes)
+        assert next(nodes) == {"id": "1", "title": "caf\u00e9"}
+        assert len(sent) == 4
+        assert page.page_info == {}
+        assert list(nodes) == [{"id": "2"}]
+        assert page.page_info == {"hasNextPage": False, "endCursor": None}
+
+    def test_unexpected_start(self, httpx_mock: HTTPXMock) -> None:
+        response = make_paginated_response("issues", [{"id": "1"}], True, "cursor1")
+        httpx_mock.add_response(content=json.dumps(response, indent=2).encode())
+        client = LinearClient(api_key="lin_api_test")
+        page = next(client.stream_pages("query", "issues"))
+        assert list(page.nodes) == [{"id": "1"}]
+        assert page.page_info == {"hasNextPage": True, "endCursor": "cursor1"}
+
+    def test_errors_after_nodes(self, httpx_mock: HTTPXMock) -> None:
+        response = make_paginated_response("issues", [{"id": "1"}])
+        response["errors"] = [{"message": "Partial"}]
+        httpx_mock.add_response(json=response)
+        client = LinearClient(api_key="lin_api_test")
+        with pytest.raises(LinearAPIError, match="Partial") as info:
+            list(client.paginate("query", "issues"))
+        assert info.value.errors == [{"message": "Partial"}]
+
+    def test_unexpected_end(self, httpx_mock: HTTPXMock) -> None:
+        response = make_paginated_response("issues", [{"id": "1"}])
+        response["extra"] = True
+        httpx_mock.add_response(json=response)
+        client = LinearClient(api_key="lin_api_test")
+        with pytest.raises(LinearAPIError, match="Unexpected end of response"):
+            list(client.paginate("query", "issues"))
+
+    def test_truncated(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(content=b'{"data":{"issues":{"nodes":[{"id":"1"},{"id"')
+        client = LinearClient(api_key="lin_api_test")
+        with pytest.raises(LinearAPIError, match="Response ended within its nodes"):
+            list(client.paginate("query", "issues"))
+
+    def test_large_node(self) -> None:
+        node = {"id": "1", "description": "x" * 1000}
+        response = make_paginated_response("issues", [node, {"id": "2"}])
+        body = json.dumps(response, separators=(",", ":")).encode()
+        attempts = []
+
+        class CountingDecoder(json.JSONDecoder):
+            def raw_decode(self, s: str, idx: int = 0) -> tuple[Any, int]:
+                attempts.append(idx)
+                return super().raw_decode(s, idx)
+
+        client = _streaming_client([body[i : i + 10] for i in range(0, len(body), 10)], [])
+        with Replacer() as replace:
+            replace("delineate.client._NodeDecoder.retry_size", 20)
+            replace("delineate.client._decoder", CountingDecoder())
+            assert list(client.paginate("query", "issues")) == [node, {"id": "2"}]
+        # Rather than once for each of the hundred or so chunks the node arrived in:
+        assert len(attempts) < 20
+
+    def test_compressed(self) -> None:
+        body = gzip.compress(json.dumps(make_paginated_response("issues", [{"id": "1"}])).encode())
+        requests: list[httpx.Request] = []
+        client = _streaming_client(
+            [body[:20], body[20:]], requests, headers={"Content-Encoding": "gzip"}
+        )
+        assert list(client.paginate("query", "issues")) == [{"id": "1"}]
+        assert "gzip" in requests[0].headers["Accept-Encoding"]
+
+
+def _response(complexity: int, seconds: float) -> httpx.Response:
+    response = httpx.Response(200, headers={"X-Complexity": str(complexity)})
+    response.elapsed = timedelta(seconds=seconds)
+    return response
+
+
+class TestPageSize:
+    def test_grow(self) -> None:
+        page_size = PageSize(100)
+        page_size.observe(_response(complexity=1000, seconds=0.5))
+        assert page_size.size == 150
+
+    def test_grow_capped(self) -> None:
+        page_size = PageSize(200)
+        page_size.observe(_response(complexity=100, seconds=0.5))
+        assert page_size.size == MAX_PAGE_SIZE
+
+    def test_hold_near_complexity_target(self) -> None:
+        page_size = PageSize(100)
+        page_size.observe(_response(complexity=4000, seconds=0.5))
+        assert page_size.size == 100
+
+    def test_hold_near_time_target(self) -> None:
+        page_size = PageSize(100)
+        page_size.observe(_response(complexity=100, seconds=4))
+        assert page_size.size == 100
+
+    def test_shrink_over_complexity_target(self) -> None:
+        page_size = PageSize(100)
+        page_size.observe(_response(complexity=6000, seconds=0.5))
+        assert page_size.size == 50
+
+    def test_shrink_slow(self) -> None:
+        page_size = PageSize(15)
+        page_size.observe(_response(complexity=100, seconds=10))
+        assert page_size.size == MIN_PAGE_SIZE
+
 
 class TestDownload:
     def test_download(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
         httpx_mock.add_response(content=b"file contents here")
         client = LinearClient(api_key="lin_api_test")
         dest = tmp_path / "test_file.bin"
-        client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest)
+        digest = client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest)
+        assert dest.read_bytes() == b"file contents here"
+        assert digest == hashlib.sha256(b"file contents here").hexdigest()
+
+    def test_preallocated(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"file contents here")
+        calls = []
+        with Replacer() as replace:
+            replace("os.posix_fallocate", lambda fd, offset, length: calls.append((offset, length)))
+            client = LinearClient(api_key="lin_api_test")
+            dest = tmp_path / "file-uuid"
+            client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest)
+        assert calls == [(0, 18)]
+        assert dest.read_bytes() == b"file contents here"
+
+    def test_resumable_not_preallocated(self, tmp_path: Path) -> None:
+        def chunks() -> Iterator[bytes]:
+            yield b"file "
+            raise httpx.ReadError("dropped")
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(
+                200, headers={"ETag": '"v1"', "Content-Length": "18"}, stream=Chunks(chunks())
+            )
+
+        calls = []
+        client = LinearClient(api_key="lin_api_test", transport=Transport(download_chunk_size=5))
+        client._uploads = httpx.Client(transport=httpx.MockTransport(handler))
+        dest = tmp_path / "file-uuid"
+        with Replacer() as replace:
+            replace("os.posix_fallocate", lambda fd, offset, length: calls.append((offset, length)))
+            # Stop before the file is truncated, as if the process had been killed:
+            replace("delineate.client._Download.close", lambda self: self._file.flush())
+            with pytest.raises(httpx.ReadError):
+                client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert calls == []
+        assert dest.stat().st_size == 5
+
+    def test_encoded(self, tmp_path: Path) -> None:
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(
+                200,
+                headers={"Content-Encoding": "gzip", "ETag": '"v1"'},
+                stream=Chunks([gzip.compress(b"file contents here")]),
+            )
+
+        client = LinearClient(api_key="lin_api_test")
+        client._uploads = httpx.Client(transport=httpx.MockTransport(handler))
+        dest = tmp_path / "file-uuid"
+        digest = client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert dest.read_bytes() == b"file contents here"
+        assert digest == hashlib.sha256(b"file contents here").hexdigest()
+
+    def test_resume(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            status_code=206,
+            headers={"Content-Range": "bytes 5-17/18", "ETag": '"v1"'},
+            content=b"contents here",
+        )
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"file ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 18}')
+        digest = client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert request.headers["Range"] == "bytes=5-"
+        assert request.headers["If-Range"] == '"v1"'
+        assert dest.read_bytes() == b"file contents here"
+        assert digest == hashlib.sha256(b"file contents here").hexdigest()
+        assert not (tmp_path / "file-uuid.meta").exists()
+
+    def test_resume_changed(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        # The ETag no longer matches, so the whole file is sent:
+        httpx_mock.add_response(headers={"ETag": '"v2"'}, content=b"new contents")
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"old ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 12}')
+        client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert dest.read_bytes() == b"new contents"
+
+    def test_resume_not_satisfiable(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(status_code=416)
+        httpx_mock.add_response(content=b"short")
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"longer than the file")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 20}')
+        client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert dest.read_bytes() == b"short"
+        assert "Range" not in httpx_mock.get_requests()[1].headers
+
+    def test_interrupted(self, tmp_path: Path) -> None:
+        def chunks() -> Iterator[bytes]:
+            yield b"file "
+            raise httpx.ReadError("dropped")
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(
+                200, headers={"ETag": '"v1"', "Content-Length": "18"}, stream=Chunks(chunks())
+            )
+
+        client = LinearClient(api_key="lin_api_test", transport=Transport(download_chunk_size=5))
+        client._uploads = httpx.Client(transport=httpx.MockTransport(handler))
+        dest = tmp_path / "file-uuid"
+        with pytest.raises(httpx.ReadError):
+            client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        # Kept, so it can be resumed:
+        assert dest.read_bytes() == b"file "
+        meta = json.loads((tmp_path / "file-uuid.meta").read_text())
+        assert meta == {"etag": '"v1"', "length": 18}
+
+    def test_failed_keeps_partial(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(status_code=503)
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"file ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 18}')
+        with pytest.raises(httpx.HTTPStatusError):
+            client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert dest.read_bytes() == b"file "
+        assert (tmp_path / "file-uuid.meta").exists()
+
+    def test_resume_length_changed(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            status_code=206,
+            headers={"Content-Range": "bytes 5-12/13", "ETag": '"v1"'},
+            content=b"contents",
+        )
+        httpx_mock.add_response(headers={"ETag": '"v2"'}, content=b"new contents")
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"file ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 18}')
+        client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert dest.read_bytes() == b"new contents"
+        assert "Range" not in httpx_mock.get_requests()[1].headers
+
+    def test_failed_removes_partial(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(status_code=404)
+        client = LinearClient(api_key="lin_api_test")
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"file ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 18}')
+        with pytest.raises(httpx.HTTPStatusError):
+            client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest, True)
+        assert list(tmp_path.iterdir()) == []
+
+
+async def _no_sleep(delay: float) -> None:
+    pass
+
+
+class TestTransport:
+    def test_options(self) -> None:
+        transport = Transport(api_connections=3, connect_timeout=2, read_timeout=5)
+        client = LinearClient(api_key="lin_api_test", transport=transport)
+        assert client._http.timeout == httpx.Timeout(5, connect=2, pool=None)
+        assert client._http.headers["Authorization"] == "lin_api_test"
+        assert client._uploads is not client._http
+        assert client._uploads.headers["Authorization"] == "lin_api_test"
+
+    def test_http2_without_h2(self) -> None:
+        with Replacer() as replace:
+            replace("delineate.client.find_spec", lambda name: None)
+            with pytest.raises(RuntimeError, match="HTTP/2 requires the h2 package"):
+                LinearClient(api_key="lin_api_test", transport=Transport(http2=True))
+
+    def test_from_auth(self, tmp_path: Path) -> None:
+        auth_file = tmp_path / ".delineate.json"
+        auth_file.write_text(
+            json.dumps(
+                {"api_key": "lin_api_test", "transport": {"read_timeout": 5, "api_connections": 2}}
+            )
+        )
+        client = client_from_auth(auth_file, transport={"read_timeout": 7})
+        assert client.transport == Transport(api_connections=2, read_timeout=7)
+
+
+class TestAsyncClient:
+    def test_query(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json={"data": {"viewer": {"id": "123", "name": "Test"}}})
+
+        async def run() -> dict[str, Any]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return await client.query("{ viewer { id name } }")
+
+        assert asyncio.run(run()) == {"viewer": {"id": "123", "name": "Test"}}
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert request.headers["Authorization"] == "lin_api_test"
+
+    def test_rate_limit_retry(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json={"errors": [{"message": "Rate limited", "extensions": {"code": "RATELIMITED"}}]},
+        )
+        httpx_mock.add_response(json={"data": {"viewer": {"id": "123"}}})
+
+        async def run() -> dict[str, Any]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return await client.query("{ viewer { id } }")
+
+        with Replacer() as r:
+            r.replace("asyncio.sleep", _no_sleep)
+            assert asyncio.run(run()) == {"viewer": {"id": "123"}}
+
+    def test_rate_limit_exhausted(self, httpx_mock: HTTPXMock) -> None:
+        for _ in range(3):
+            httpx_mock.add_response(
+                json={
+                    "errors": [{"message": "Rate limited", "extensions": {"code": "RATELIMITED"}}]
+                },
+            )
+
+        async def run() -> dict[str, Any]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return await client.query("{ viewer { id } }")
+
+        with Replacer() as r:
+            r.replace("asyncio.sleep", _no_sleep)
+            with pytest.raises(LinearAPIError, match="Rate limited after max retries"):
+                asyncio.run(run())
+
+    def test_graphql_error(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json={"errors": [{"message": "Field 'foo' not found on type 'Query'"}]},
+        )
+
+        async def run() -> dict[str, Any]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return await client.query("{ foo }")
+
+        with pytest.raises(LinearAPIError, match="Field 'foo' not found"):
+            asyncio.run(run())
+
+    def test_paginate(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            json=make_paginated_response(
+                "issues", [{"id": "1"}], has_next=True, end_cursor="cursor1"
+            ),
+        )
+        httpx_mock.add_response(json=make_paginated_response("issues", [{"id": "2"}]))
+
+        async def run() -> list[dict[str, Any]]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return [node async for node in client.paginate("query", "issues")]
+
+        assert asyncio.run(run()) == [{"id": "1"}, {"id": "2"}]
+        second = httpx_mock.get_requests()[1]
+        assert json.loads(second.content)["variables"] == {"first": 100, "after": "cursor1"}
+
+    def test_download(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"file contents here")
+        dest = tmp_path / "test_file.bin"
+
+        async def run() -> None:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                await client.download("https://uploads.linear.app/ws/uuid/file-uuid", dest)
+
+        asyncio.run(run())
+        assert dest.read_bytes() == b"file contents here"
+
+    def test_paginate_page_size(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_exception(httpx.ReadTimeout("too slow"))
+        httpx_mock.add_response(
+            json=make_paginated_response(
+                "issues", [{"id": "1"}], has_next=True, end_cursor="cursor1"
+            ),
+        )
+        httpx_mock.add_response(json=make_paginated_response("issues", [{"id": "2"}]))
+        page_size = PageSize(40)
+
+        async def run() -> list[dict[str, Any]]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return [node async for node in client.paginate("query", "issues", None, page_size)]
+
+        assert asyncio.run(run()) == [{"id": "1"}, {"id": "2"}]
+        sizes = [json.loads(r.content)["variables"]["first"] for r in httpx_mock.get_requests()]
+        assert sizes == [40, 20, 30]
+
+    def test_paginate_errors_after_nodes(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(
+            content=b'{"data":{"issues":{"nodes":[{"id":"1"}],'
+            b'"pageInfo":{"hasNextPage":false,"endCursor":null}}},'
+            b'"errors":[{"message":"Partial failure"}]}'
+        )
+
+        async def run() -> list[dict[str, Any]]:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return [node async for node in client.paginate("query", "issues")]
+
+        with pytest.raises(LinearAPIError, match="Partial failure"):
+            asyncio.run(run())
+
+    def test_download_resume(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            status_code=206,
+            headers={"Content-Range": "bytes 5-17/18", "ETag": '"v1"'},
+            content=b"contents here",
+        )
+        dest = tmp_path / "file-uuid"
+        dest.write_bytes(b"file ")
+        (tmp_path / "file-uuid.meta").write_text('{"etag": "\\"v1\\"", "length": 18}')
+
+        async def run() -> str:
+            async with AsyncLinearClient(api_key="lin_api_test") as client:
+                return await client.download(
+                    "https://uploads.linear.app/ws/uuid/file-uuid", dest, True
+                )
+
+        digest = asyncio.run(run())
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert request.headers["Range"] == "bytes=5-"
         assert dest.read_bytes() == b"file contents here"
+        assert digest == hashlib.sha256(b"file contents here").hexdigest()
+        assert not (tmp_path / "file-uuid.meta").exists()
@@ -1,18 +1,33 @@
+import hashlib
 import json
+from collections.abc import Iterator
 from pathlib import Path
+from unittest.mock import Mock
 
+import httpx
+import pytest
 from pytest_httpx import HTTPXMock
+from testfixtures import Replacer
 
-from delineate.client import LinearClient
+from delineate.client import LinearClient, Transport
 from delineate.downloads import (
-    append_manifest,
+    Downloader,
+    Manifest,
+    UrlIndex,
+    blob_path,
     download_all,
     download_file,
     extract_upload_urls,
     file_dir,
-    load_manifest,
 )
 
+from .helpers import Chunks
+
+
+def _urls(dest_dir: Path) -> set[str]:
+    with Manifest(dest_dir) as manifest:
+        return set(manifest)
+
 
 class TestExtractUploadUrls:
     def test_image(self) -> None:
@@ -76,6 +91,51 @@ class TestDownloadFile:
         )
         assert filename == "report.pdf"
         assert (tmp_path / "abcd" / "abcd1234" / "report.pdf").read_bytes() == b"pdf contents"
+        assert list((tmp_path / ".partial").iterdir()) == []
+
+    def test_resume(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            status_code=206,
+            headers={"Content-Range": "bytes 4-11/12", "ETag": '"v1"'},
+            content=b"contents",
+        )
+        partial = tmp_path / ".partial"
+        partial.mkdir()
+        (partial / "abcd1234").write_bytes(b"pdf ")
+        (partial / "abcd1234.meta").write_text(json.dumps({"etag": '"v1"', "length": 12}))
+        client = LinearClient(api_key="lin_api_test")
+        filename = download_file(
+            client, "https://uploads.linear.app/ws/uuid/abcd1234", "report.pdf", tmp_path
+        )
+        assert filename == "report.pdf"
+        assert (tmp_path / "abcd" / "abcd1234" / "report.pdf").read_bytes() == b"pdf contents"
+        assert list(partial.iterdir()) == []
+
+    def test_dedup(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"logo", is_reusable=True)
+        client = LinearClient(api_key="lin_api_test")
+        for url in (
+            "https://uploads.linear.app/ws/uuid/abcd1234",
+            "https://uploads.linear.app/ws/uuid/bcde2345",
+        ):
+            assert download_file(client, url, "logo.png", tmp_path, dedup=True) == "logo.png"
+        first = tmp_path / "abcd" / "abcd1234" / "logo.png"
+        second = tmp_path / "bcde" / "bcde2345" / "logo.png"
+        blob = blob_path(tmp_path, hashlib.sha256(b"logo").hexdigest())
+        assert blob.read_bytes() == b"logo"
+        assert first.stat().st_ino == second.stat().st_ino == blob.stat().st_ino
+        assert list(blob.parent.iterdir()) == [blob]
+
+    def test_dedup_without_hard_links(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"logo")
+        client = LinearClient(api_key="lin_api_test")
+        with Replacer() as replace:
+            replace("os.link", Mock(side_effect=OSError("not supported")))
+            download_file(
+                client, "https://uploads.linear.app/ws/uuid/abcd1234", "logo.png", tmp_path, True
+            )
+        assert (tmp_path / "abcd" / "abcd1234" / "logo.png").read_bytes() == b"logo"
+        assert blob_path(tmp_path, hashlib.sha256(b"logo").hexdigest()).exists()
 
     def test_skip_existing(self, tmp_path: Path) -> None:
         file_directory = tmp_path / "abcd" / "abcd1234"
@@ -116,29 +176,135 @@ class TestDownloadFile:
         assert filename is None
         assert not (tmp_path / "abcd" / "abcd1234").exists()  # No directory created on failure
 
+    def test_transport_error(self, tmp_path: Path) -> None:
+        def chunks() -> Iterator[bytes]:
+            yield b"da"
+            raise httpx.ReadError("dropped")
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(
+                200, headers={"ETag": '"v1"', "Content-Length": "4"}, stream=Chunks(chunks())
+            )
+
+        client = LinearClient(api_key="lin_api_test", transport=Transport(download_chunk_size=2))
+        client._uploads = httpx.Client(transport=httpx.MockTransport(handler))
+        url = "https://uploads.linear.app/ws/uuid/abcd1234"
+        assert download_file(client, url, "report.pdf", tmp_path) is None
+        # Kept so the download can be resumed:
+        assert (tmp_path / ".partial" / "abcd1234").read_bytes() == b"da"
+        assert (tmp_path / ".partial" / "abcd1234.meta").exists()
+
+
+class TestUrlIndex:
+    def test_new_urls(self, tmp_path: Path) -> None:
+        issue = {
+            "id": "i1",
+            "updatedAt": "2024-06-15T12:00:00Z",
+            "description": "![a](https://uploads.linear.app/ws/u1/aaaa1111?signature=x) "
+            "[again](https://uploads.linear.app/ws/u1/aaaa1111)",
+        }
+        index = UrlIndex(tmp_path / "urls")
+        assert index.new_urls("issues", issue, ["description"]) == [
+            ("a", "https://uploads.linear.app/ws/u1/aaaa1111")
+        ]
+        index.save()
+        index = UrlIndex(tmp_path / "urls")
+        # Unchanged since it was last seen:
+        assert index.new_urls("issues", issue, ["description"]) == []
+        updated = {
+            **issue,
+            "updatedAt": "2024-06-16T12:00:00Z",
+            "description": issue["description"] + " [b](https://uploads.linear.app/ws/u2/bbbb2222)",
+        }
+        assert index.new_urls("issues", updated, ["description"]) == [
+            ("b", "https://uploads.linear.app/ws/u2/bbbb2222")
+        ]
+
+    def test_failed(self, tmp_path: Path) -> None:
+        issue = {
+            "id": "i1",
+            "updatedAt": "2024-06-15T12:00:00Z",
+            "description": "![a](https://uploads.linear.app/ws/u1/aaaa1111) "
+            "![b](https://uploads.linear.app/ws/u2/bbbb2222)",
+        }
+        index = UrlIndex(tmp_path / "urls")
+        assert len(index.new_urls("issues", issue, ["description"])) == 2
+        index.failed("https://uploads.linear.app/ws/u2/bbbb2222")
+        index.save()
+        index = UrlIndex(tmp_path / "urls")
+        # Searched again, even though it has not been updated, and the failed file found again:
+        assert index.new_urls("issues", issue, ["description"]) == [
+            ("b", "https://uploads.linear.app/ws/u2/bbbb2222")
+        ]
+
+    def test_succeeded(self, tmp_path: Path) -> None:
+        issue = {
+            "id": "i1",
+            "updatedAt": "2024-06-15T12:00:00Z",
+            "description": "![a](https://uploads.linear.app/ws/u1/aaaa1111)",
+        }
+        index = UrlIndex(tmp_path / "urls")
+        index.new_urls("issues", issue, ["description"])
+        index.succeeded("https://uploads.linear.app/ws/u1/aaaa1111")
+        # Where it was found has been forgotten, so a later failure changes nothing:
+        index.failed("https://uploads.linear.app/ws/u1/aaaa1111")
+        index.save()
+        assert UrlIndex(tmp_path / "urls").new_urls("issues", issue, ["description"]) == []
+
+    def test_field_not_exported(self, tmp_path: Path) -> None:
+        issue = {"id": "i1", "updatedAt": "2024-06-15T12:00:00Z"}
+        index = UrlIndex(tmp_path / "urls")
+        assert index.new_urls("issues", issue, ["description"]) == []
+        # Found once the field is exported:
+        issue["description"] = "![a](https://uploads.linear.app/ws/u1/aaaa1111)"
+        assert index.new_urls("issues", issue, ["description"]) == [
+            ("a", "https://uploads.linear.app/ws/u1/aaaa1111")
+        ]
+
+    def test_no_updated_at(self, tmp_path: Path) -> None:
+        entity = {"id": "d1", "content": "![a](https://uploads.linear.app/ws/u1/aaaa1111)"}
+        index = UrlIndex(tmp_path / "urls")
+        assert len(index.new_urls("documents", entity, ["content"])) == 1
+        # Searched again, but nothing new is found:
+        assert index.new_urls("documents", entity, ["content"]) == []
+
 
 class TestManifest:
-    def test_load_empty(self, tmp_path: Path) -> None:
-        result = load_manifest(tmp_path)
-        assert result == set()
+    def test_empty(self, tmp_path: Path) -> None:
+        with Manifest(tmp_path) as manifest:
+            assert "https://example.com/a" not in manifest
+            assert set(manifest) == set()
+
+    def test_add(self, tmp_path: Path) -> None:
+        with Manifest(tmp_path, batch_size=2) as manifest:
+            manifest.add("https://example.com/a", "a.png")
+            # Found before it is committed:
+            assert manifest.get("https://example.com/a") == "a.png"
+            manifest.add("https://example.com/b", "b.pdf")
+            manifest.add("https://example.com/c", "c.txt")
+        with Manifest(tmp_path) as manifest:
+            assert "https://example.com/b" in manifest
+            assert manifest.get("https://example.com/c") == "c.txt"
+            assert manifest.get("https://example.com/d") is None
+            assert set(manifest) == {
+                "https://example.com/a",
+                "https://example.com/b",
+                "https://example.com/c",
+            }
 
-    def test_load_existing(self, tmp_path: Path) -> None:
+    def test_migrate(self, tmp_path: Path) -> None:
         manifest_path = tmp_path / "manifest.jsonl"
         manifest_path.write_text(
             '{"url": "https://example.com/a", "filename": "a.png"}\n'
+            "\n"
             '{"url": "https://example.com/b", "filename": "b.pdf"}\n'
         )
-        result = load_manifest(tmp_path)
-        assert result == {"https://example.com/a", "https://example.com/b"}
-
-    def test_append(self, tmp_path: Path) -> None:
-        append_manifest(tmp_path, "https://example.com/a", "a.png")
-        append_manifest(tmp_path, "https://example.com/b", "b.pdf")
-        manifest_path = tmp_path / "manifest.jsonl"
-        lines = manifest_path.read_text().splitlines()
-        assert len(lines) == 2
-        assert json.loads(lines[0]) == {"url": "https://example.com/a", "filename": "a.png"}
-        assert json.loads(lines[1]) == {"url": "https://example.com/b", "filename": "b.pdf"}
+        with Manifest(tmp_path) as manifest:
+            assert manifest.get("https://example.com/a") == "a.png"
+            assert manifest.get("https://example.com/b") == "b.pdf"
+        assert not manifest_path.exists()
+        assert (tmp_path / "manifest.jsonl.migrated").exists()
+        assert _urls(tmp_path) == {"https://example.com/a", "https://example.com/b"}
 
 
 class TestDownloadAll:
@@ -154,8 +320,7 @@ class TestDownloadAll:
         download_all(client, urls, files_dir)
         assert (files_dir / "aaaa" / "aaaa1111" / "img.png").read_bytes() == b"file1 data"
         assert (files_dir / "bbbb" / "bbbb2222" / "doc.pdf").read_bytes() == b"file2 data"
-        manifest = load_manifest(files_dir)
-        assert manifest == {
+        assert _urls(files_dir) == {
             "https://uploads.linear.app/ws/u1/aaaa1111",
             "https://uploads.linear.app/ws/u2/bbbb2222",
         }
@@ -169,8 +334,7 @@ class TestDownloadAll:
         ]
         files_dir = tmp_path / "files"
         download_all(client, urls, files_dir)
-        manifest = load_manifest(files_dir)
-        assert len(manifest) == 1
+        assert len(_urls(files_dir)) == 1
 
     def test_with_failures(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
         httpx_mock.add_response(content=b"file1 data")
@@ -184,8 +348,7 @@ class TestDownloadAll:
         ]
         files_dir = tmp_path / "files"
         download_all(client, urls, files_dir)
-        manifest = load_manifest(files_dir)
-        assert manifest == {
+        assert _urls(files_dir) == {
             "https://uploads.linear.app/ws/u1/aaaa1111",
             "https://uploads.linear.app/ws/u3/cccc3333",
         }
@@ -197,7 +360,8 @@ class TestDownloadAll:
         files_dir = tmp_path / "files"
         files_dir.mkdir()
         # Pre-populate manifest with already downloaded URL
-        append_manifest(files_dir, "https://uploads.linear.app/ws/u1/aaaa1111", "img.png")
+        with Manifest(files_dir) as manifest:
+            manifest.add("https://uploads.linear.app/ws/u1/aaaa1111", "img.png")
         # Only expect one download (the second URL)
         httpx_mock.add_response(content=b"file2 data")
         client = LinearClient(api_key="lin_api_test")
@@ -207,3 +371,116 @@ class TestDownloadAll:
         ]
         download_all(client, urls, files_dir)
         assert (files_dir / "bbbb" / "bbbb2222" / "doc.pdf").read_bytes() == b"file2 data"
+
+    def test_parallel(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        def respond(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(200, content=request.url.path.encode())
+
+        httpx_mock.add_callback(respond, is_reusable=True)
+        client = LinearClient(api_key="lin_api_test")
+        urls = [
+            (f"file{i}.txt", f"https://uploads.linear.app/ws/u/{i:04d}{i:04d}") for i in range(20)
+        ]
+        files_dir = tmp_path / "files"
+        download_all(client, urls + urls, files_dir, workers=4)
+        for i in range(20):
+            path = files_dir / f"{i:04d}" / f"{i:04d}{i:04d}" / f"file{i}.txt"
+            assert path.read_bytes() == f"/ws/u/{i:04d}{i:04d}".encode()
+        assert len(httpx_mock.get_requests()) == 20
+        assert _urls(files_dir) == {url for _, url in urls}
+
+
+class TestDownloader:
+    def test_submit_while_running(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"file1 data")
+        httpx_mock.add_response(content=b"file2 data")
+        client = LinearClient(api_key="lin_api_test")
+        files_dir = tmp_path / "files"
+        progress: list[None] = []
+        with Downloader(
+            client, files_dir, queue_size=1, progress=lambda: progress.append(None)
+        ) as downloader:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            downloader.submit("doc.pdf", "https://uploads.linear.app/ws/u2/bbbb2222")
+        assert (files_dir / "aaaa" / "aaaa1111" / "img.png").read_bytes() == b"file1 data"
+        assert (files_dir / "bbbb" / "bbbb2222" / "doc.pdf").read_bytes() == b"file2 data"
+        assert len(progress) == 2
+
+    def test_failed(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(status_code=404)
+        client = LinearClient(api_key="lin_api_test")
+        failed: list[str] = []
+        with Downloader(client, tmp_path, failed=failed.append) as downloader:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+        assert failed == ["https://uploads.linear.app/ws/u1/aaaa1111"]
+
+    def test_succeeded(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"data", url="https://uploads.linear.app/ws/u1/aaaa1111")
+        httpx_mock.add_response(status_code=404, url="https://uploads.linear.app/ws/u2/bbbb2222")
+        client = LinearClient(api_key="lin_api_test")
+        succeeded: list[str] = []
+        failed: list[str] = []
+        with Downloader(
+            client, tmp_path, succeeded=succeeded.append, failed=failed.append
+        ) as downloader:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            downloader.submit("doc.pdf", "https://uploads.linear.app/ws/u2/bbbb2222")
+        assert succeeded == ["https://uploads.linear.app/ws/u1/aaaa1111"]
+        with Downloader(
+            client, tmp_path, succeeded=succeeded.append, failed=failed.append
+        ) as downloader:
+            # Already downloaded by the earlier export:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+        assert succeeded == ["https://uploads.linear.app/ws/u1/aaaa1111"] * 2
+        assert failed == ["https://uploads.linear.app/ws/u2/bbbb2222"]
+
+    def test_transport_error(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_exception(
+            httpx.ReadError("dropped"), url="https://uploads.linear.app/ws/u1/aaaa1111"
+        )
+        httpx_mock.add_response(content=b"data", url="https://uploads.linear.app/ws/u2/bbbb2222")
+        client = LinearClient(api_key="lin_api_test")
+        failed: list[str] = []
+        with Downloader(client, tmp_path, failed=failed.append) as downloader:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            downloader.submit("doc.pdf", "https://uploads.linear.app/ws/u2/bbbb2222")
+        assert failed == ["https://uploads.linear.app/ws/u1/aaaa1111"]
+        assert (tmp_path / "bbbb" / "bbbb2222" / "doc.pdf").read_bytes() == b"data"
+
+    def test_pending(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"data")
+        client = LinearClient(api_key="lin_api_test")
+        downloader = Downloader(client, tmp_path)
+        downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+        assert downloader.pending() == [("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")]
+        with downloader:
+            pass
+        assert downloader.pending() == []
+
+    def test_nothing_submitted(self, tmp_path: Path) -> None:
+        client = LinearClient(api_key="lin_api_test")
+        files_dir = tmp_path / "files"
+        with Downloader(client, files_dir, workers=2):
+            pass
+        assert not files_dir.exists()
+
+    def test_worker_error(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_exception(OSError("boom"))
+        client = LinearClient(api_key="lin_api_test")
+        with (
+            pytest.raises(OSError, match="boom"),
+            Downloader(client, tmp_path, queue_size=1) as downloader,
+        ):
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            # Later submissions must not block on a queue nobody is draining:
+            downloader.submit("a.png", "https://uploads.linear.app/ws/u2/bbbb2222")
+            downloader.submit("b.png", "https://uploads.linear.app/ws/u3/cccc3333")
+        assert _urls(tmp_path) == set()
+
+    def test_producer_error(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(content=b"data", is_optional=True)
+        client = LinearClient(api_key="lin_api_test")
+        with pytest.raises(RuntimeError), Downloader(client, tmp_path) as downloader:
+            downloader.submit("img.png", "https://uploads.linear.app/ws/u1/aaaa1111")
+            raise RuntimeError()
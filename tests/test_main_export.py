@@ -1,9 +1,38 @@
 import json
+import os
+import threading
+from collections.abc import Iterator
+from datetime import UTC, datetime
 from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
 
+import httpx
+import pytest
+from click.testing import CliRunner
 from pytest_httpx import HTTPXMock
-
-from delineate.export import LatestData, entity_path
+from testfixtures import Replacer
+
+from delineate.client import LinearClient
+from delineate.downloads import Manifest
+from delineate.exceptions import LinearAPIError
+from delineate.export import (
+    EPOCH,
+    EXPORTS,
+    Checkpoint,
+    LatestData,
+    PageSizes,
+    check_profile,
+    compact_json,
+    entity_path,
+    first_pages,
+    merged,
+    pretty_json,
+    time_slices,
+    write_atomic,
+)
+from delineate.main import cli
+from delineate.storage import JSONLStorage, SQLiteStorage
 
 from .helpers import make_paginated_response, run_cli
 
@@ -24,6 +53,56 @@ class TestEntityPath:
         path = entity_path(tmp_path, "comments", "ff991234-0000-0000-0000-000000000000")
         assert path == tmp_path / "comments" / "ff99" / "ff991234-0000-0000-0000-000000000000.json"
 
+    def test_created_directories_cached(self, tmp_path: Path) -> None:
+        created: set[Path] = set()
+        path = entity_path(tmp_path, "issues", "a01126f0-8a0a-4c98-ac24-b15a7706d048", created)
+        assert created == {path.parent}
+        path.parent.rmdir()
+        entity_path(tmp_path, "issues", "a011ffff-0000-0000-0000-000000000000", created)
+        assert not path.parent.exists()
+
+
+class TestSerializers:
+    def test_pretty(self) -> None:
+        entity = {"id": "1", "title": "Caf\u00e9", "labels": {"nodes": []}}
+        assert pretty_json(entity) == (json.dumps(entity, indent=2) + "\n").encode()
+
+    def test_compact(self) -> None:
+        entity = {"id": "1", "title": "Caf\u00e9", "labels": {"nodes": []}}
+        data = compact_json(entity)
+        assert data.endswith(b"}\n")
+        assert data.count(b"\n") == 1
+        assert json.loads(data) == entity
+
+
+class TestWriteAtomic:
+    def test_replace(self, tmp_path: Path) -> None:
+        path = tmp_path / "latest.json"
+        path.write_text("old")
+        write_atomic(path, b"new", sync=True)
+        assert path.read_text() == "new"
+        assert [p.name for p in tmp_path.iterdir()] == ["latest.json"]
+
+    def test_permissions(self, tmp_path: Path) -> None:
+        path = tmp_path / "latest.json"
+        umask = os.umask(0o022)
+        try:
+            write_atomic(path, b"new")
+        finally:
+            os.umask(umask)
+        assert path.stat().st_mode & 0o777 == 0o644
+
+    def test_error(self, tmp_path: Path) -> None:
+        path = tmp_path / "latest.json"
+        path.write_text("old")
+        with Replacer() as replace:
+            replace("os.fsync", Mock(side_effect=OSError("disk full")))
+            with pytest.raises(OSError, match="disk full"):
+                write_atomic(path, b"new", sync=True)
+        # The original content survives and nothing is left behind:
+        assert path.read_text() == "old"
+        assert [p.name for p in tmp_path.iterdir()] == ["latest.json"]
+
 
 class TestLatestData:
     def test_load_missing(self, tmp_path: Path) -> None:
@@ -44,6 +123,297 @@ class TestLatestData:
         assert data == {"issues": "2024-06-01T00:00:00Z"}
 
 
+class TestTimeSlices:
+    def test_slices(self) -> None:
+        end = datetime(2024, 1, 1, tzinfo=UTC)
+        assert time_slices("2023-12-29T00:00:00.000Z", 3, end) == [
+            {"lte": "2023-12-30T00:00:00.000Z"},
+            {"gt": "2023-12-30T00:00:00.000Z", "lte": "2023-12-31T00:00:00.000Z"},
+            {"gt": "2023-12-31T00:00:00.000Z"},
+        ]
+
+    def test_single(self) -> None:
+        assert time_slices(EPOCH, 1) == [{}]
+
+
+class TestMerged:
+    def test_merged(self) -> None:
+        assert sorted(merged([iter([1, 2, 3]), iter([]), iter([4, 5])], buffer=1)) == [
+            1,
+            2,
+            3,
+            4,
+            5,
+        ]
+
+    def test_error(self) -> None:
+        def failing() -> Iterator[int]:
+            yield 1
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError, match="boom"):
+            list(merged([failing(), iter(range(1000))], buffer=1))
+
+    def test_consumer_stops_early(self) -> None:
+        items = merged([iter(range(1000)), iter(range(1000))], buffer=1)
+        assert next(items) == 0
+        del items
+
+
+class TestExportItems:
+    def test_slices(self, httpx_mock: HTTPXMock) -> None:
+        nodes = {
+            "lte": {"id": "1", "updatedAt": "2024-01-01T00:00:00Z"},
+            "gt": {"id": "3", "updatedAt": "2024-03-01T00:00:00Z"},
+            "both": {"id": "2", "updatedAt": "2024-02-01T00:00:00Z"},
+        }
+
+        def respond(request: httpx.Request) -> httpx.Response:
+            comparator = json.loads(request.content)["variables"]["filter"]["updatedAt"]
+            if "gt" in comparator and "lte" in comparator:
+                node = nodes["both"]
+            else:
+                node = nodes["gt" if "gt" in comparator else "lte"]
+            return httpx.Response(200, json=make_paginated_response("issues", [node]))
+
+        httpx_mock.add_callback(respond, is_reusable=True)
+        latest = LatestData()
+        client = LinearClient(api_key="lin_api_test")
+        items = list(EXPORTS["issues"].items(client, latest, slices=3))
+        assert sorted(item["id"] for item in items) == ["1", "2", "3"]
+        assert latest == {"issues": "2024-03-01T00:00:00Z"}
+
+    def test_slices_with_update(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json=make_paginated_response("issues", []), is_reusable=True)
+        latest = LatestData({"issues": "2024-01-01T00:00:00.000Z"})
+        client = LinearClient(api_key="lin_api_test")
+        assert (
+            list(EXPORTS["issues"].items(client, latest, slices=2, slice_field="createdAt")) == []
+        )
+        filters = [json.loads(r.content)["variables"]["filter"] for r in httpx_mock.get_requests()]
+        assert [f["updatedAt"] for f in filters] == [{"gt": "2024-01-01T00:00:00.000Z"}] * 2
+        assert sorted(list(f["createdAt"]) for f in filters) == [["gt"], ["lte"]]
+        assert latest == {"issues": "2024-01-01T00:00:00.000Z"}
+
+
+class TestNestedConnections:
+    def test_completed(self, httpx_mock: HTTPXMock) -> None:
+        def labels(ids: list[str], end_cursor: str | None = None) -> dict[str, Any]:
+            return {
+                "nodes": [{"id": i} for i in ids],
+                "pageInfo": {"hasNextPage": end_cursor is not None, "endCursor": end_cursor},
+            }
+
+        issues = [
+            {"id": "1", "labels": labels(["a"])},
+            {"id": "2", "labels": labels(["b"], "b-cursor")},
+            {"id": "3", "labels": labels(["c"], "c-cursor")},
+        ]
+        httpx_mock.add_response(json=make_paginated_response("issues", issues))
+        httpx_mock.add_response(
+            json={
+                "data": {
+                    "n0": {"labels": labels(["b2"])},
+                    "n1": {"labels": labels(["c2"], "c2-cursor")},
+                }
+            }
+        )
+        httpx_mock.add_response(json={"data": {"n0": {"labels": labels(["c3"])}}})
+        client = LinearClient(api_key="lin_api_test")
+
+        items = list(EXPORTS["issues"].items(client))
+
+        assert items == [
+            {"id": "1", "labels": {"nodes": [{"id": "a"}]}},
+            {"id": "2", "labels": {"nodes": [{"id": "b"}, {"id": "b2"}]}},
+            {"id": "3", "labels": {"nodes": [{"id": "c"}, {"id": "c2"}, {"id": "c3"}]}},
+        ]
+        _, first, second = [json.loads(r.content) for r in httpx_mock.get_requests()]
+        assert "n1: issue(id: $id1)" in first["query"]
+        assert first["variables"] == {
+            "first": 250,
+            "id0": "2",
+            "after0": "b-cursor",
+            "id1": "3",
+            "after1": "c-cursor",
+        }
+        assert second["variables"] == {"first": 250, "id0": "3", "after0": "c2-cursor"}
+
+
+class TestFirstPages:
+    def test_batched(self, httpx_mock: HTTPXMock) -> None:
+        teams = make_paginated_response("teams", [{"id": "1"}])["data"]["teams"]
+        users = make_paginated_response("users", [], True, "cursor1")["data"]["users"]
+        httpx_mock.add_response(json={"data": {"c0": teams, "c1": users}})
+        client = LinearClient(api_key="lin_api_test")
+        latest = LatestData({"users": "2024-01-01T00:00:00Z"})
+        exports = [EXPORTS["teams"], EXPORTS["users"]]
+
+        pages = first_pages(client, exports, latest, PageSizes({"teams": 40}))
+
+        assert pages == {"teams": teams, "users": users}
+        request = httpx_mock.get_request()
+        assert request is not None
+        payload = json.loads(request.content)
+        assert "c0: teams(first: $first0, filter: $filter0)" in payload["query"]
+        assert "c1: users(first: $first1, filter: $filter1)" in payload["query"]
+        assert payload["variables"] == {
+            "first0": 40,
+            "first1": 100,
+            "filter1": {"updatedAt": {"gt": "2024-01-01T00:00:00Z"}},
+        }
+
+    def test_split_on_error(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json={"errors": [{"message": "Query too complex"}]})
+        users = make_paginated_response("users", [])["data"]["users"]
+        cycles = make_paginated_response("cycles", [])["data"]["cycles"]
+        httpx_mock.add_response(json={"data": {"c0": users, "c1": cycles}})
+        client = LinearClient(api_key="lin_api_test")
+        exports = [EXPORTS["teams"], EXPORTS["users"], EXPORTS["cycles"]]
+        assert first_pages(client, exports) == {"users": users, "cycles": cycles}
+        assert len(httpx_mock.get_requests()) == 2
+
+    def test_other_errors_not_split(self, httpx_mock: HTTPXMock) -> None:
+        httpx_mock.add_response(json={"errors": [{"message": "Authentication required"}]})
+        client = LinearClient(api_key="lin_api_test")
+        exports = [EXPORTS["teams"], EXPORTS["users"], EXPORTS["workflow_states"]]
+        with pytest.raises(LinearAPIError, match="Authentication required"):
+            first_pages(client, exports)
+        assert len(httpx_mock.get_requests()) == 1
+
+    def test_single(self, httpx_mock: HTTPXMock) -> None:
+        client = LinearClient(api_key="lin_api_test")
+        assert first_pages(client, [EXPORTS["teams"]]) == {}
+
+    def test_only_small_exports_batched(self) -> None:
+        batched = {name for name, exp in EXPORTS.items() if exp.batched}
+        assert batched == {
+            "teams",
+            "users",
+            "issue_labels",
+            "workflow_states",
+            "project_milestones",
+        }
+
+    def test_items_continue_from_first_page(self, httpx_mock: HTTPXMock) -> None:
+        first = make_paginated_response("teams", [{"id": "1"}], True, "cursor1")["data"]["teams"]
+        httpx_mock.add_response(json=make_paginated_response("teams", [{"id": "2"}]))
+        client = LinearClient(api_key="lin_api_test")
+        items = list(EXPORTS["teams"].items(client, first_page=first))
+        assert [item["id"] for item in items] == ["1", "2"]
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert json.loads(request.content)["variables"]["after"] == "cursor1"
+
+
+class TestProfiles:
+    def test_full(self) -> None:
+        for exp in EXPORTS.values():
+            assert exp.profiled("full") == exp
+
+    def test_metadata(self) -> None:
+        query = EXPORTS["issues"].profiled("metadata").query
+        assert "            title\n" in query
+        assert "state { id name type color }" in query
+        assert "description" not in query
+        assert "labels" not in query
+        assert "teams" not in EXPORTS["projects"].profiled("metadata").query
+        assert "content" not in EXPORTS["documents"].profiled("metadata").query
+
+    def test_check_profile(self, tmp_path: Path) -> None:
+        check_profile(tmp_path, "metadata")
+        assert (tmp_path / "profile").read_text() == "metadata\n"
+        check_profile(tmp_path, "metadata")
+        with pytest.raises(ValueError, match="exported with the 'metadata' profile"):
+            check_profile(tmp_path, "full")
+
+    def test_check_profile_before_recorded(self, tmp_path: Path) -> None:
+        (tmp_path / "latest.json").write_text("{}")
+        with pytest.raises(ValueError, match="exported with the 'full' profile"):
+            check_profile(tmp_path, "metadata")
+        assert not (tmp_path / "profile").exists()
+
+
+class TestCheckpoint:
+    def test_items_commit_pages(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            json=make_paginated_response(
+                "teams", [{"id": "1", "updatedAt": "2024-01-01T00:00:00Z"}], True, "cursor1"
+            )
+        )
+        httpx_mock.add_response(json=make_paginated_response("teams", [{"id": "2"}]))
+        path = tmp_path / "checkpoint.json"
+        checkpoint = Checkpoint(path, interval=0)
+        client = LinearClient(api_key="lin_api_test")
+        items = EXPORTS["teams"].items(client, checkpoint=checkpoint)
+        assert next(items)["id"] == "1"
+        assert not path.exists()
+        assert next(items)["id"] == "2"
+        assert Checkpoint.load(path).entities == {
+            "teams": {
+                "slices": [{"filter": {}, "after": "cursor1", "done": False}],
+                "max_updated": "2024-01-01T00:00:00Z",
+            }
+        }
+        assert list(items) == []
+        assert checkpoint.entities["teams"]["slices"][0]["done"]
+
+    def test_items_resume(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            json=make_paginated_response("issues", [{"id": "2", "updatedAt": "2024-01-02"}])
+        )
+        checkpoint = Checkpoint(
+            tmp_path / "checkpoint.json",
+            entities={
+                "issues": {
+                    "slices": [
+                        {"filter": {"createdAt": {"lte": "2024"}}, "after": None, "done": True},
+                        {"filter": {"createdAt": {"gt": "2024"}}, "after": "c1", "done": False},
+                    ],
+                    "max_updated": "2024-01-03",
+                },
+                "teams": {
+                    "slices": [{"filter": {}, "after": "c2", "done": True}],
+                    "max_updated": "2024-01-01",
+                },
+            },
+        )
+        client = LinearClient(api_key="lin_api_test")
+        latest = LatestData()
+        assert list(EXPORTS["issues"].items(client, latest, checkpoint=checkpoint)) == [
+            {"id": "2", "updatedAt": "2024-01-02"}
+        ]
+        assert list(EXPORTS["teams"].items(client, latest, checkpoint=checkpoint)) == []
+        assert latest == {"issues": "2024-01-03", "teams": "2024-01-01"}
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert json.loads(request.content)["variables"] == {
+            "filter": {"createdAt": {"gt": "2024"}},
+            "after": "c1",
+            "first": 100,
+        }
+
+    def test_load_missing(self, tmp_path: Path) -> None:
+        checkpoint = Checkpoint.load(tmp_path / "checkpoint.json")
+        assert checkpoint.entities == {}
+        assert checkpoint.downloads == []
+
+    def test_save_and_load(self, tmp_path: Path) -> None:
+        path = tmp_path / "checkpoint.json"
+        checkpoint = Checkpoint(path)
+        flushed: list[None] = []
+        checkpoint.before_save = lambda: flushed.append(None)
+        checkpoint.pending_downloads = lambda: [("img.png", "https://uploads.linear.app/a")]
+        checkpoint.start("teams", {"slices": [], "max_updated": None})
+        checkpoint.save()
+        assert flushed == [None]
+        loaded = Checkpoint.load(path)
+        assert loaded.entities == {"teams": {"slices": [], "max_updated": None}}
+        assert loaded.downloads == [("img.png", "https://uploads.linear.app/a")]
+        loaded.remove()
+        assert not path.exists()
+
+
 class TestExportCommand:
     def test_single_entity(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
         auth_file = _make_auth_file(tmp_path)
@@ -251,7 +621,329 @@ class TestExportCommand:
 
         files_dir = export_dir / "files"
         assert (files_dir / "abcd" / "abcd1234" / "screenshot").exists()
-        assert (files_dir / "manifest.jsonl").exists()
-        manifest_line = (files_dir / "manifest.jsonl").read_text().strip()
-        manifest_entry = json.loads(manifest_line)
-        assert manifest_entry["url"] == "https://uploads.linear.app/ws/uuid/abcd1234"
+        with Manifest(files_dir) as manifest:
+            assert manifest.get("https://uploads.linear.app/ws/uuid/abcd1234") == "screenshot"
+        index = json.loads((export_dir / "urls" / "issues.json").read_text())
+        assert index == {
+            "a01126f0-8a0a-4c98-ac24-b15a7706d048": {
+                "updatedAt": "2024-06-15T12:00:00Z",
+                "urls": ["https://uploads.linear.app/ws/uuid/abcd1234"],
+            }
+        }
+
+    def test_concurrency(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        export_dir.mkdir()
+
+        responses = {
+            "teams": make_paginated_response(
+                "teams",
+                [
+                    {
+                        "id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab",
+                        "updatedAt": "2024-01-01T00:00:00Z",
+                    }
+                ],
+            ),
+            "users": make_paginated_response(
+                "users",
+                [
+                    {
+                        "id": "5ce3c6a0-7d1a-4c0e-9a3b-0a1b2c3d4e5f",
+                        "updatedAt": "2024-02-01T00:00:00Z",
+                    }
+                ],
+            ),
+        }
+
+        def respond(request: httpx.Request) -> httpx.Response:
+            query = json.loads(request.content)["query"]
+            data = {}
+            for connection_path, response in responses.items():
+                for alias in "c0: ", "c1: ", "":
+                    if f"{alias}{connection_path}(" in query:
+                        data[alias[:-2] or connection_path] = response["data"][connection_path]
+                        break
+            assert data, query
+            return httpx.Response(200, json={"data": data})
+
+        httpx_mock.add_callback(respond, is_reusable=True)
+
+        result = run_cli(
+            "--auth",
+            str(auth_file),
+            "export",
+            "--path",
+            str(export_dir),
+            "--concurrency",
+            "2",
+            "--write-workers",
+            "2",
+            "teams",
+            "users",
+        )
+        assert result.exit_code == 0
+
+        assert (
+            export_dir / "teams" / "8391" / "83914fc0-4a65-463c-b1d3-ffe9e75070ab.json"
+        ).exists()
+        assert (
+            export_dir / "users" / "5ce3" / "5ce3c6a0-7d1a-4c0e-9a3b-0a1b2c3d4e5f.json"
+        ).exists()
+        latest = LatestData.load(export_dir / "latest.json")
+        assert latest == {"teams": "2024-01-01T00:00:00Z", "users": "2024-02-01T00:00:00Z"}
+
+    def test_concurrency_failure(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        users_started = threading.Event()
+
+        def respond(request: httpx.Request) -> httpx.Response:
+            query = json.loads(request.content)["query"]
+            if "teams(" in query:
+                users_started.wait()
+                return httpx.Response(200, json={"errors": [{"message": "teams broke"}]})
+            users_started.set()
+            # Users never end, so the export only finishes if they are stopped:
+            user = {"id": "5ce3c6a0-7d1a-4c0e-9a3b-0a1b2c3d4e5f"}
+            return httpx.Response(
+                200, json=make_paginated_response("users", [user], has_next=True, end_cursor="c")
+            )
+
+        httpx_mock.add_callback(respond, is_reusable=True)
+        with Replacer() as replace:
+            replace("delineate.main.first_pages", lambda *args: {})
+            with pytest.raises(LinearAPIError, match="teams broke"):
+                run_cli(
+                    "--auth",
+                    str(auth_file),
+                    "export",
+                    "--path",
+                    str(tmp_path / "export"),
+                    "--concurrency",
+                    "2",
+                    "teams",
+                    "users",
+                )
+
+    def test_page_sizes_recorded(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        export_dir.mkdir()
+        (export_dir / "page_sizes.json").write_text(json.dumps({"teams": 40}))
+
+        httpx_mock.add_response(
+            json=make_paginated_response("teams", [{"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab"}]),
+            headers={"X-Complexity": "200"},
+        )
+
+        result = run_cli("--auth", str(auth_file), "export", "--path", str(export_dir), "teams")
+        assert result.exit_code == 0
+
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert json.loads(request.content)["variables"]["first"] == 40
+        assert PageSizes.load(export_dir / "page_sizes.json") == {"teams": 60}
+
+    def test_slices(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        httpx_mock.add_response(json=make_paginated_response("teams", []), is_reusable=True)
+
+        result = run_cli(
+            "--auth",
+            str(auth_file),
+            "export",
+            "--path",
+            str(export_dir),
+            "--slices",
+            "teams=4",
+            "teams",
+        )
+        assert result.exit_code == 0
+        assert len(httpx_mock.get_requests()) == 4
+
+    def test_slices_invalid(self, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        result = CliRunner().invoke(cli, ["--auth", str(auth_file), "export", "--slices", "teams"])
+        assert result.exit_code != 0
+        assert "Expected ENTITY=N, got 'teams'" in result.output
+
+    def test_slices_unknown_entity(self, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        result = CliRunner().invoke(cli, ["--auth", str(auth_file), "export", "--slices", "foo=2"])
+        assert result.exit_code != 0
+        assert "Unknown entities: foo" in result.output
+
+    def test_sqlite_format(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        httpx_mock.add_response(
+            json=make_paginated_response(
+                "teams", [{"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab", "name": "Engineering"}]
+            ),
+        )
+
+        result = run_cli(
+            "--auth",
+            str(auth_file),
+            "export",
+            "--path",
+            str(export_dir),
+            "--format",
+            "sqlite",
+            "teams",
+        )
+        assert result.exit_code == 0
+
+        assert not (export_dir / "teams").exists()
+        with SQLiteStorage(export_dir) as storage:
+            team = storage.get("teams", "83914fc0-4a65-463c-b1d3-ffe9e75070ab")
+        assert team == {"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab", "name": "Engineering"}
+
+    def test_jsonl_format(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        team = {"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab", "name": "Engineering"}
+        httpx_mock.add_response(json=make_paginated_response("teams", [team]))
+
+        result = run_cli(
+            "--auth",
+            str(auth_file),
+            "export",
+            "--path",
+            str(export_dir),
+            "--format",
+            "jsonl.gz",
+            "teams",
+        )
+        assert result.exit_code == 0
+
+        assert (export_dir / "teams" / "000001.jsonl.gz").exists()
+        with JSONLStorage(export_dir, compression="gzip") as storage:
+            assert storage.get("teams", team["id"]) == team
+
+    def test_reports_unchanged(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        team = {"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab", "name": "Engineering"}
+        httpx_mock.add_response(json=make_paginated_response("teams", [team]), is_reusable=True)
+
+        args = ("--auth", str(auth_file), "export", "--path", str(export_dir), "teams")
+        result = run_cli(*args)
+        assert result.exit_code == 0
+        assert "teams: 1 written, 0 unchanged" in result.output
+
+        result = run_cli(*args)
+        assert result.exit_code == 0
+        assert "teams: 0 written, 1 unchanged" in result.output
+
+    def test_profile(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        httpx_mock.add_response(json=make_paginated_response("documents", []))
+        result = run_cli(
+            "--auth",
+            str(auth_file),
+            "export",
+            "--path",
+            str(tmp_path / "export"),
+            "--profile",
+            "metadata",
+            "documents",
+        )
+        assert result.exit_code == 0
+        request = httpx_mock.get_request()
+        assert request is not None
+        query = json.loads(request.content)["query"]
+        assert "title" in query
+        assert "content" not in query
+
+    def test_profile_mixed(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        httpx_mock.add_response(json=make_paginated_response("documents", []))
+        args = ("--auth", str(auth_file), "export", "--path", str(tmp_path / "export"))
+        assert run_cli(*args, "documents").exit_code == 0
+        result = run_cli(*args, "--update", "--profile", "metadata", "documents")
+        assert result.exit_code == 1
+        assert "exported with the 'full' profile" in result.output
+
+    def test_http2_without_h2(self, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        with Replacer() as replace:
+            replace("delineate.client.find_spec", lambda name: None)
+            result = CliRunner().invoke(cli, ["--auth", str(auth_file), "export", "--http2"])
+        assert result.exit_code == 1
+        assert "HTTP/2 requires the h2 package" in result.output
+
+    def test_reconcile(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        kept = {"id": "83914fc0-4a65-463c-b1d3-ffe9e75070ab", "name": "Engineering"}
+        deleted = {"id": "b0000000-0000-0000-0000-000000000000", "name": "Gone"}
+        args = ("--auth", str(auth_file), "export", "--path", str(export_dir))
+        httpx_mock.add_response(json=make_paginated_response("teams", [kept, deleted]))
+        assert run_cli(*args, "teams").exit_code == 0
+
+        httpx_mock.add_response(json=make_paginated_response("teams", []))
+        httpx_mock.add_response(json=make_paginated_response("teams", [{"id": kept["id"]}]))
+        result = run_cli(*args, "--update", "--reconcile", "remove", "teams")
+        assert result.exit_code == 0
+        assert "teams: 0 written, 0 unchanged, 1 missing" in result.output
+        assert not (export_dir / "teams" / "b000").joinpath(f"{deleted['id']}.json").exists()
+        tombstone = json.loads((export_dir / "tombstones.jsonl").read_text())
+        assert tombstone["id"] == deleted["id"]
+
+    def test_resume(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        args = ["--auth", str(auth_file), "export", "--path", str(export_dir)]
+        first_page = make_paginated_response(
+            "issues",
+            [{"id": "a01126f0-8a0a-4c98-ac24-b15a7706d048", "updatedAt": "2024-06-15T12:00:00Z"}],
+            has_next=True,
+            end_cursor="cursor1",
+        )
+        httpx_mock.add_response(json=first_page)
+        httpx_mock.add_response(json={"errors": [{"message": "Boom"}]})
+
+        with pytest.raises(LinearAPIError, match="Boom"):
+            run_cli(*args, "--checkpoint-interval", "0", "issues")
+
+        checkpoint = Checkpoint.load(export_dir / "checkpoint.json")
+        assert checkpoint.entities["issues"]["slices"][0]["after"] == "cursor1"
+        assert (export_dir / "issues" / "a011").exists()
+        httpx_mock.reset()
+
+        httpx_mock.add_response(
+            json=make_paginated_response(
+                "issues",
+                [{"id": "b0000000-0000-0000-0000-000000000000", "updatedAt": "2024-06-01"}],
+            )
+        )
+        result = run_cli(*args, "--resume", "issues")
+        assert result.exit_code == 0
+        request = httpx_mock.get_request()
+        assert request is not None
+        assert json.loads(request.content)["variables"]["after"] == "cursor1"
+        assert not (export_dir / "checkpoint.json").exists()
+        latest = LatestData.load(export_dir / "latest.json")
+        assert latest == {"issues": "2024-06-15T12:00:00Z"}
+
+    def test_resume_pending_downloads(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        auth_file = _make_auth_file(tmp_path)
+        export_dir = tmp_path / "export"
+        upload = "https://uploads.linear.app/ws/uuid/abcd1234"
+        checkpoint = Checkpoint(
+            export_dir / "checkpoint.json",
+            entities={"teams": {"slices": [{"filter": {}, "after": None, "done": True}]}},
+        )
+        checkpoint.entities["teams"]["max_updated"] = None
+        checkpoint.pending_downloads = lambda: [("img.png", upload)]
+        checkpoint.save()
+        httpx_mock.add_response(content=b"png data", url=upload)
+
+        result = run_cli(
+            "--auth", str(auth_file), "export", "--path", str(export_dir), "--resume", "teams"
+        )
+        assert result.exit_code == 0
+        assert (export_dir / "files" / "abcd" / "abcd1234" / "img.png").read_bytes() == b"png data"
@@ -0,0 +1,83 @@
+from collections.abc import Iterator
+
+import pytest
+from testfixtures import Replacer
+
+from delineate.ratelimit import Budget, RateLimiter
+
+NOW = 1_700_000_000.0
+
+
+def _headers(remaining: int, complexity_remaining: int = 100_000) -> dict[str, str]:
+    reset = str(int((NOW + 3600) * 1000))
+    return {
+        "x-ratelimit-requests-limit": "1500",
+        "x-ratelimit-requests-remaining": str(remaining),
+        "x-ratelimit-requests-reset": reset,
+        "x-ratelimit-complexity-limit": "250000",
+        "x-ratelimit-complexity-remaining": str(complexity_remaining),
+        "x-ratelimit-complexity-reset": reset,
+        "x-complexity": "500",
+    }
+
+
+@pytest.fixture()
+def now() -> Iterator[None]:
+    with Replacer() as r:
+        r.replace("time.time", lambda: NOW)
+        yield
+
+
+class TestRateLimiter:
+    def test_no_budgets(self) -> None:
+        limiter = RateLimiter()
+        assert limiter.acquire() == 0
+
+    def test_update(self, now: None) -> None:
+        limiter = RateLimiter()
+        limiter.update(_headers(remaining=1000))
+        assert limiter.budgets == {
+            "requests": Budget(limit=1500, remaining=1000, reset=NOW + 3600),
+            "complexity": Budget(limit=250000, remaining=100000, reset=NOW + 3600, cost=500),
+        }
+
+    def test_update_missing_headers(self) -> None:
+        limiter = RateLimiter()
+        limiter.update({"x-ratelimit-requests-limit": "1500"})
+        assert limiter.budgets == {}
+
+    def test_plenty_of_budget(self, now: None) -> None:
+        limiter = RateLimiter()
+        limiter.update(_headers(remaining=1000))
+        assert limiter.acquire() == 0
+        assert limiter.budgets["requests"].remaining == 999
+        assert limiter.budgets["complexity"].remaining == 99500
+
+    def test_paces_near_limit(self, now: None) -> None:
+        limiter = RateLimiter()
+        # 75 requests is the reserve, so the budget is exhausted:
+        limiter.update(_headers(remaining=75))
+        first = limiter.acquire()
+        second = limiter.acquire()
+        assert first > 0
+        # Concurrent callers queue up behind each other:
+        assert second > first
+
+    def test_complexity_budget(self, now: None) -> None:
+        limiter = RateLimiter()
+        limiter.update(_headers(remaining=1000, complexity_remaining=12_000))
+        assert limiter.acquire() > 0
+
+    def test_reset_passed(self) -> None:
+        limiter = RateLimiter()
+        with Replacer() as r:
+            r.replace("time.time", lambda: NOW)
+            limiter.update(_headers(remaining=0))
+            r.replace("time.time", lambda: NOW + 3601)
+            assert limiter.acquire() == 0
+
+    def test_back_off(self, now: None) -> None:
+        limiter = RateLimiter()
+        wait = limiter.back_off(2)
+        assert 2 <= wait <= 4
+        assert limiter.acquire() == pytest.approx(wait)
@@ -0,0 +1,69 @@
+import json
+from pathlib import Path
+
+from pytest_httpx import HTTPXMock
+
+from delineate.client import LinearClient
+from delineate.export import EXPORTS
+from delineate.reconcile import Tombstones, reconcile
+from delineate.storage import FileStorage
+
+from .helpers import make_paginated_response
+
+
+def _tombstones(path: Path) -> list[tuple[str, str]]:
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    return [(entry["entity_type"], entry["id"]) for entry in entries]
+
+
+class TestTombstones:
+    def test_add_once(self, tmp_path: Path) -> None:
+        path = tmp_path / "tombstones.jsonl"
+        Tombstones(path).add("issues", "1")
+        tombstones = Tombstones(path)
+        tombstones.add("issues", "1")
+        tombstones.add("teams", "1")
+        assert _tombstones(path) == [("issues", "1"), ("teams", "1")]
+        assert "detectedAt" in json.loads(path.read_text().splitlines()[0])
+
+
+class TestReconcile:
+    def _storage(self, tmp_path: Path) -> FileStorage:
+        storage = FileStorage(tmp_path)
+        for uuid in "abcd1", "abcd2", "abcd3":
+            storage.write("teams", {"id": uuid})
+        return storage
+
+    def test_tombstone(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(
+            json=make_paginated_response("teams", [{"id": "abcd1"}], True, "cursor1")
+        )
+        httpx_mock.add_response(json=make_paginated_response("teams", [{"id": "abcd3"}]))
+        client = LinearClient(api_key="lin_api_test")
+        storage = self._storage(tmp_path)
+        tombstones = Tombstones(tmp_path / "tombstones.jsonl")
+
+        assert reconcile(client, EXPORTS["teams"], storage, tombstones) == ["abcd2"]
+
+        assert _tombstones(tmp_path / "tombstones.jsonl") == [("teams", "abcd2")]
+        assert storage.ids("teams") == {"abcd1", "abcd2", "abcd3"}
+        first, second = httpx_mock.get_requests()
+        payload = json.loads(first.content)
+        assert "nodes { id }" in payload["query"]
+        assert payload["variables"] == {"first": 250}
+        assert json.loads(second.content)["variables"]["after"] == "cursor1"
+
+    def test_remove(self, httpx_mock: HTTPXMock, tmp_path: Path) -> None:
+        httpx_mock.add_response(json=make_paginated_response("teams", [{"id": "abcd1"}]))
+        client = LinearClient(api_key="lin_api_test")
+        storage = self._storage(tmp_path)
+        tombstones = Tombstones(tmp_path / "tombstones.jsonl")
+
+        missing = reconcile(client, EXPORTS["teams"], storage, tombstones, "remove")
+
+        assert missing == ["abcd2", "abcd3"]
+        assert storage.ids("teams") == {"abcd1"}
+        assert _tombstones(tmp_path / "tombstones.jsonl") == [
+            ("teams", "abcd2"),
+            ("teams", "abcd3"),
+        ]
@@ -0,0 +1,403 @@
+import gzip
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any
+from unittest.mock import Mock
+
+import pytest
+from testfixtures import Replacer
+
+from delineate.storage import (
+    FORMATS,
+    FileStorage,
+    JSONLStorage,
+    SQLiteStorage,
+    Storage,
+    WriteBehind,
+)
+
+ISSUE = {
+    "id": "a01126f0-8a0a-4c98-ac24-b15a7706d048",
+    "title": "Test Issue",
+    "updatedAt": "2024-06-15T12:00:00Z",
+}
+
+
+class TestStorage:
+    def test_incomplete(self, tmp_path: Path) -> None:
+        class WriteOnly(Storage):
+            kind = "write-only"
+
+            def _write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+                return True
+
+        with pytest.raises(TypeError, match="abstract"):
+            WriteOnly(tmp_path)  # type: ignore[abstract]
+
+
+class TestFileStorage:
+    def test_write(self, tmp_path: Path) -> None:
+        with FileStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+        path = tmp_path / "issues" / "a011" / "a01126f0-8a0a-4c98-ac24-b15a7706d048.json"
+        assert json.loads(path.read_text()) == ISSUE
+
+    def test_get(self, tmp_path: Path) -> None:
+        with FileStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            assert storage.get("issues", ISSUE["id"]) == ISSUE
+            assert storage.get("issues", "ffff0000") is None
+
+    def test_unchanged(self, tmp_path: Path) -> None:
+        with FileStorage(tmp_path) as storage:
+            assert storage.write("issues", ISSUE)
+        path = tmp_path / "issues" / "a011" / "a01126f0-8a0a-4c98-ac24-b15a7706d048.json"
+        mtime = path.stat().st_mtime_ns
+        with FileStorage(tmp_path) as storage:
+            assert not storage.write("issues", ISSUE)
+            assert storage.write("issues", {**ISSUE, "title": "Renamed"})
+            assert storage.written == {"issues": 1}
+            assert storage.unchanged == {"issues": 1}
+        assert json.loads(path.read_text())["title"] == "Renamed"
+        assert path.stat().st_mtime_ns >= mtime
+        hashes = json.loads((tmp_path / "hashes" / "files" / "issues.json").read_text())
+        assert list(hashes) == [ISSUE["id"]]
+
+    def test_unchanged_but_missing(self, tmp_path: Path) -> None:
+        with FileStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+        path = tmp_path / "issues" / "a011" / "a01126f0-8a0a-4c98-ac24-b15a7706d048.json"
+        path.unlink()
+        with FileStorage(tmp_path) as storage:
+            assert storage.write("issues", ISSUE)
+        assert json.loads(path.read_text()) == ISSUE
+
+    def test_compact(self, tmp_path: Path) -> None:
+        with FORMATS["files.compact"](tmp_path) as storage:
+            storage.write("issues", ISSUE)
+        path = tmp_path / "issues" / "a011" / "a01126f0-8a0a-4c98-ac24-b15a7706d048.json"
+        assert path.read_text().count("\n") == 1
+        assert json.loads(path.read_text()) == ISSUE
+        with FileStorage(tmp_path) as storage:
+            assert storage.get("issues", ISSUE["id"]) == ISSUE
+            # Written again when switching back:
+            assert storage.write("issues", ISSUE)
+        assert path.read_text() == json.dumps(ISSUE, indent=2) + "\n"
+
+    def test_remove(self, tmp_path: Path) -> None:
+        with FileStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000"})
+            assert storage.ids("issues") == {ISSUE["id"], "b0000000"}
+            storage.remove("issues", ISSUE["id"])
+            assert storage.ids("issues") == {"b0000000"}
+            assert storage.get("issues", ISSUE["id"]) is None
+            assert storage.removed == {"issues": 1}
+            # Written again if it comes back:
+            assert storage.write("issues", ISSUE)
+        assert storage.ids("teams") == set()
+
+    def test_fsync_batch(self, tmp_path: Path) -> None:
+        sync_paths = Mock()
+        with Replacer() as replace:
+            replace("delineate.storage.FSYNC_BATCH_SIZE", 2)
+            replace("delineate.storage.sync_paths", sync_paths)
+            with FileStorage(tmp_path, fsync="batch") as storage:
+                for uuid in "a000", "b000", "c000":
+                    storage.write("issues", {"id": uuid})
+                assert [len(call.args[0]) for call in sync_paths.call_args_list] == [2]
+                storage.flush()
+                assert sync_paths.call_args_list[-1].args[0] == [
+                    tmp_path / "issues" / "c000" / "c000.json"
+                ]
+
+    def test_fsync_always(self, tmp_path: Path) -> None:
+        fsync = Mock()
+        with Replacer() as replace:
+            replace("os.fsync", fsync)
+            with FileStorage(tmp_path, fsync="always") as storage:
+                storage.write("issues", ISSUE)
+                # The file and its directory:
+                assert fsync.call_count == 2
+        assert storage.get("issues", ISSUE["id"]) == ISSUE
+
+    def test_fsync_never(self, tmp_path: Path) -> None:
+        fsync = Mock()
+        with Replacer() as replace:
+            replace("os.fsync", fsync)
+            with FileStorage(tmp_path) as storage:
+                storage.write("issues", ISSUE)
+        fsync.assert_not_called()
+        assert not list((tmp_path / "issues" / "a011").glob(".*"))
+
+
+class TestSQLiteStorage:
+    def test_write(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("teams", {"id": "t1", "name": "Engineering"})
+        connection = sqlite3.connect(tmp_path / "export.sqlite")
+        rows = connection.execute("SELECT id, updated_at, data FROM issues").fetchall()
+        assert rows == [(ISSUE["id"], "2024-06-15T12:00:00Z", json.dumps(ISSUE))]
+        rows = connection.execute("SELECT id, updated_at FROM teams").fetchall()
+        assert rows == [("t1", None)]
+
+    def test_batched(self, tmp_path: Path) -> None:
+        storage = SQLiteStorage(tmp_path, batch_size=2)
+        connection = sqlite3.connect(tmp_path / "export.sqlite")
+        storage.write("teams", {"id": "t1"})
+        assert connection.execute("SELECT name FROM sqlite_master").fetchall() == []
+        storage.write("teams", {"id": "t2"})
+        assert connection.execute("SELECT count(*) FROM teams").fetchone() == (2,)
+        storage.write("teams", {"id": "t3"})
+        storage.close()
+        assert connection.execute("SELECT count(*) FROM teams").fetchone() == (3,)
+
+    def test_replace(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {**ISSUE, "title": "Renamed"})
+            result = storage.get("issues", ISSUE["id"])
+        assert result is not None
+        assert result["title"] == "Renamed"
+
+    def test_unchanged(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            assert storage.write("issues", ISSUE)
+        with SQLiteStorage(tmp_path) as storage:
+            assert not storage.write("issues", ISSUE)
+        assert (tmp_path / "hashes" / "sqlite" / "issues.json").exists()
+
+    def test_get_missing(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            assert storage.get("issues", ISSUE["id"]) is None
+
+    def test_reopen(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+        with SQLiteStorage(tmp_path) as storage:
+            assert storage.get("issues", ISSUE["id"]) == ISSUE
+
+    def test_remove(self, tmp_path: Path) -> None:
+        with SQLiteStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000"})
+            assert storage.ids("issues") == {ISSUE["id"], "b0000000"}
+            storage.remove("issues", ISSUE["id"])
+        with SQLiteStorage(tmp_path) as storage:
+            assert storage.ids("issues") == {"b0000000"}
+            assert storage.get("issues", ISSUE["id"]) is None
+            assert storage.write("issues", ISSUE)
+
+
+class TestJSONLStorage:
+    def test_write(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000", "title": "Other"})
+        lines = (tmp_path / "issues" / "000001.jsonl").read_text().splitlines()
+        assert [json.loads(line) for line in lines] == [ISSUE, {"id": "b0000000", "title": "Other"}]
+        index = (tmp_path / "issues" / "index.jsonl").read_text().splitlines()
+        assert [json.loads(line) for line in index] == [
+            {
+                "id": ISSUE["id"],
+                "segment": 1,
+                "file": "000001.jsonl",
+                "offset": 0,
+                "length": len(lines[0]) + 1,
+            },
+            {
+                "id": "b0000000",
+                "segment": 1,
+                "file": "000001.jsonl",
+                "offset": len(lines[0]) + 1,
+                "length": len(lines[1]) + 1,
+            },
+        ]
+
+    def test_get(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {**ISSUE, "title": "Renamed"})
+            assert storage.get("issues", ISSUE["id"]) == {**ISSUE, "title": "Renamed"}
+            assert storage.get("issues", "ffff0000") is None
+
+    def test_rolling_segments(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path, segment_size=1) as storage:
+            storage.write("teams", {"id": "t1"})
+            storage.write("teams", {"id": "t2"})
+        with JSONLStorage(tmp_path) as storage:
+            storage.write("teams", {"id": "t3"})
+            assert storage.get("teams", "t1") == {"id": "t1"}
+            assert storage.get("teams", "t3") == {"id": "t3"}
+        assert sorted(p.name for p in (tmp_path / "teams").iterdir()) == [
+            "000001.jsonl",
+            "000002.jsonl",
+            "000003.jsonl",
+            "index.jsonl",
+        ]
+
+    def test_mixed_formats(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path) as storage:
+            storage.write("teams", {"id": "t1"})
+        with JSONLStorage(tmp_path, compression="gzip") as storage:
+            storage.write("teams", {"id": "t2"})
+            assert storage.get("teams", "t1") == {"id": "t1"}
+            assert storage.get("teams", "t2") == {"id": "t2"}
+        with JSONLStorage(tmp_path) as storage:
+            assert storage.get("teams", "t2") == {"id": "t2"}
+
+    def test_index_without_file_names(self, tmp_path: Path) -> None:
+        directory = tmp_path / "teams"
+        directory.mkdir()
+        (directory / "000001.jsonl").write_text('{"id":"t1"}\n')
+        (directory / "index.jsonl").write_text(
+            '{"id": "t1", "segment": 1, "offset": 0, "length": 12}\n'
+        )
+        with JSONLStorage(tmp_path) as storage:
+            assert storage.get("teams", "t1") == {"id": "t1"}
+
+    def test_unchanged(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path) as storage:
+            assert storage.write("issues", ISSUE)
+        with JSONLStorage(tmp_path) as storage:
+            assert not storage.write("issues", ISSUE)
+        # Nothing was appended by the second export:
+        assert not (tmp_path / "issues" / "000002.jsonl").exists()
+        assert len((tmp_path / "issues" / "index.jsonl").read_text().splitlines()) == 1
+
+    def test_gzip(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path, compression="gzip") as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000"})
+            assert storage.get("issues", "b0000000") == {"id": "b0000000"}
+        with gzip.open(tmp_path / "issues" / "000001.jsonl.gz") as segment:
+            assert json.loads(segment.readline()) == ISSUE
+        with JSONLStorage(tmp_path, compression="gzip") as storage:
+            assert storage.get("issues", ISSUE["id"]) == ISSUE
+
+    def test_zstd(self, tmp_path: Path) -> None:
+        pytest.importorskip("zstandard")
+        with JSONLStorage(tmp_path, compression="zstd") as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000"})
+        assert (tmp_path / "issues" / "000001.jsonl.zst").exists()
+        with JSONLStorage(tmp_path, compression="zstd") as storage:
+            assert storage.get("issues", "b0000000") == {"id": "b0000000"}
+
+    def test_fsync(self, tmp_path: Path) -> None:
+        fsync = Mock()
+        with Replacer() as replace:
+            replace("os.fsync", fsync)
+            with JSONLStorage(tmp_path, compression="gzip", fsync="batch") as storage:
+                storage.write("issues", ISSUE)
+                storage.flush()
+                # The segment and the index:
+                assert fsync.call_count == 2
+        assert storage.ids("issues") == {ISSUE["id"]}
+
+    def test_remove(self, tmp_path: Path) -> None:
+        with JSONLStorage(tmp_path) as storage:
+            storage.write("issues", ISSUE)
+            storage.write("issues", {"id": "b0000000"})
+            storage.remove("issues", ISSUE["id"])
+            assert storage.ids("issues") == {"b0000000"}
+        index = (tmp_path / "issues" / "index.jsonl").read_text().splitlines()
+        assert json.loads(index[-1]) == {"id": ISSUE["id"], "segment": None}
+        with JSONLStorage(tmp_path) as storage:
+            assert storage.get("issues", ISSUE["id"]) is None
+            assert storage.write("issues", ISSUE)
+            assert storage.get("issues", ISSUE["id"]) == ISSUE
+            assert storage.ids("issues") == {ISSUE["id"], "b0000000"}
+
+
+class _BlockingStorage(FileStorage):
+    def __init__(self, base_dir: Path) -> None:
+        super().__init__(base_dir)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _write(self, entity_type: str, entity: dict[str, Any]) -> bool:
+        if entity["id"] == "boom":
+            raise ValueError("boom")
+        self.started.set()
+        self.release.wait()
+        return super()._write(entity_type, entity)
+
+
+class _ReleasingWriteBehind(WriteBehind):
+    """
+    Releases the blocked storage only once the writer has been aborted.
+    """
+
+    storage: _BlockingStorage
+
+    def _stop(self) -> None:
+        self.storage.release.set()
+        super()._stop()
+
+
+class TestWriteBehind:
+    def test_write(self, tmp_path: Path) -> None:
+        storage = FileStorage(tmp_path)
+        with WriteBehind(storage, workers=3) as writer:
+            for i in range(20):
+                writer.submit("teams", {"id": f"t{i:03d}"})
+                writer.submit("teams", {"id": f"t{i:03d}", "name": "Renamed"})
+        assert storage.written == {"teams": 40}
+        assert storage.ids("teams") == {f"t{i:03d}" for i in range(20)}
+        # Each entity is written by one worker, so the last version wins:
+        assert storage.get("teams", "t007") == {"id": "t007", "name": "Renamed"}
+
+    def test_flush_waits(self, tmp_path: Path) -> None:
+        storage = _BlockingStorage(tmp_path)
+        with WriteBehind(storage, workers=2) as writer:
+            writer.submit("teams", {"id": "t1"})
+            flusher = threading.Thread(target=writer.flush)
+            flusher.start()
+            flusher.join(0.1)
+            assert flusher.is_alive()
+            storage.release.set()
+            flusher.join()
+            assert storage.ids("teams") == {"t1"}
+
+    def test_back_pressure(self, tmp_path: Path) -> None:
+        storage = _BlockingStorage(tmp_path)
+        with WriteBehind(storage, queue_size=1) as writer:
+            writer.submit("teams", {"id": "t1"})
+            writer.submit("teams", {"id": "t2"})
+            submitter = threading.Thread(target=writer.submit, args=("teams", {"id": "t3"}))
+            submitter.start()
+            submitter.join(0.1)
+            assert submitter.is_alive()
+            storage.release.set()
+            submitter.join()
+        assert storage.written == {"teams": 3}
+
+    def test_error(self, tmp_path: Path) -> None:
+        storage = _BlockingStorage(tmp_path)
+        storage.release.set()
+        writer = WriteBehind(storage)
+        with pytest.raises(ValueError, match="boom"), writer:
+            writer.submit("teams", {"id": "boom"})
+        with pytest.raises(ValueError, match="boom"):
+            writer.submit("teams", {"id": "t1"})
+
+    def test_error_on_flush(self, tmp_path: Path) -> None:
+        storage = _BlockingStorage(tmp_path)
+        storage.release.set()
+        with pytest.raises(ValueError, match="boom"), WriteBehind(storage) as writer:
+            writer.submit("teams", {"id": "boom"})
+            writer.flush()
+
+    def test_abort(self, tmp_path: Path) -> None:
+        storage = _BlockingStorage(tmp_path)
+        with pytest.raises(KeyError), _ReleasingWriteBehind(storage) as writer:
+            writer.submit("teams", {"id": "t1"})
+            writer.submit("teams", {"id": "t2"})
+            # Finish writing the first entity only once the export has failed:
+            storage.started.wait()
+            raise KeyError()
+        assert storage.written == {"teams": 1}